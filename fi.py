@@ -13,8 +13,101 @@ Date: 02/06/2018
 
 
 
+import argparse
+import cProfile
+import csv
+import hashlib
+import itertools
+import json
+import math
 import os
 import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+
+# Number of simulations computed together by a single worker. Shards always
+# have this size (except the last), unless a memory limit needs smaller ones,
+# see plan_memory(), so the random streams and the merged results do not
+# depend on the number of workers.
+SHARD_SIZE = 1000
+
+# Fewest independent units, see success_units(), a standard error is used to
+# stop a run at, see run_to_precision(). A lattice shard is a single unit.
+MIN_UNITS = 10
+
+# Number of simulations the solver tests a candidate spend with between checks
+# of its confidence interval, see solve_annual_spend().
+SOLVE_BATCH = 100
+
+# Memory a worker process is estimated to use before it runs a shard, and the
+# most bytes run_simulations() uses per balance of a shard, see plan_memory().
+PROCESS_MEMORY = 64 * 1024 * 1024
+BALANCE_MEMORY = 48
+
+# Schemes the random shocks can be drawn with, see draw_uniforms().
+SAMPLING_SCHEMES = ('random', 'antithetic', 'qmc')
+
+# Names of the run_simulation() parameters, in the order it takes them.
+PARAMETER_NAMES = ('annual_spend', 'inflation_rate', 'savings_balance',
+        'interest_rate', 'num_years', 'inflation_change', 'interest_change')
+# Parameters that are whole numbers, the amounts and years, the rates are real
+# numbers.
+INTEGER_PARAMETERS = ('annual_spend', 'savings_balance', 'num_years')
+
+# Binary result files start with BINARY_MAGIC, followed by a JSON header padded
+# to BINARY_HEADER_SIZE bytes, the balance matrix and one success flag per
+# simulation.
+BINARY_MAGIC = b'FIRESULT'
+BINARY_HEADER_SIZE = 4096
+
+# Formatted output is written to disk each time this many bytes are buffered.
+FLUSH_SIZE = 4 * 1024 * 1024
+
+# Text and binary runs save a checkpoint next to their output file at least
+# this many seconds apart, so they can be resumed or topped up.
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHECKPOINT_INTERVAL = 30
+
+# Text and binary runs also write a summary index next to their output file,
+# INDEX_MAGIC followed by a JSON header padded to INDEX_HEADER_SIZE bytes and one
+# INDEX_DTYPE record per simulation, so figui.py can open the output without
+# rescanning its balances.
+INDEX_SUFFIX = '.index'
+INDEX_MAGIC = b'FIINDEX\0'
+INDEX_HEADER_SIZE = 1024
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('maximum', '<f8'), ('minimum', '<f8'),
+        ('mean', '<f8'), ('final', '<f8'), ('successful', 'u1')])
+
+# Percentiles of the balance in each year drawn by figui.py's fan chart, at most
+# BAND_YEARS evenly spaced years, saved next to the result file once computed.
+BAND_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+BAND_YEARS = 1000
+BANDS_SUFFIX = '.bands'
+
+# Version of the simulation engine's results. Increase it whenever a change
+# alters the balances produced for a seed, so cached results are not reused.
+ENGINE_VERSION = 1
+
+# Most memory used by the main process for the final balances and years of
+# depletion of a chunk of clients in a cohort batch, and by a worker for one of
+# its jobs, with the bytes each uses per path of a client, and a worker per
+# path and year of its shocks, see run_cohort().
+COHORT_MEMORY = 256 * 1024 * 1024
+COHORT_WORKER_MEMORY = 128 * 1024 * 1024
+COHORT_PATH_MEMORY = 20
+COHORT_WORKER_PATH_MEMORY = 72
+COHORT_SHOCK_MEMORY = 48
+
+# Cache used by the interactive prompts, and its default size limit.
+CACHE_DIR = '.ficache'
+CACHE_SIZE = 1024 * 1024 * 1024
 
 
 
@@ -187,32 +280,153 @@ def get_simulations_to_run():
             return get_simulations_to_run()
 
 
+def get_seed():
+    """Request a seed for the random number generator, validate input,
+    recursive until input is valid. Returns None if left blank."""
+    print("\nEnter a seed to make the results reproducible:")
+    user_input = input("(Must be positive integer, leave blank for a random seed): ")
+    if user_input.strip() == "":
+        return None
+    seed = validate_positive_integer(user_input)
+    if seed == "invalid_input":
+        return get_seed()
+    else:
+        return seed
+
+
+def get_use_cache():
+    """Ask whether to keep a seeded run's results in CACHE_DIR, recursive until
+    input is valid. Returns True or False, False if left blank."""
+    decision = str(input("\nKeep the results in '" + CACHE_DIR + "' to reuse them " +
+        "when this seed is entered again?\n'Yes' or 'No' (leave blank for No): "))
+    if decision.strip() == "" or decision.upper() in ("NO", "N"):
+        return False
+    elif decision.upper() in ("YES", "Y"):
+        return True
+    else:
+        print("\n", decision, "is not a valid option.")
+        return get_use_cache()
+
+
+
+def get_output_format():
+    """Request the format to write results in, recursive until input is valid.
+    Returns 'text' or 'binary'."""
+    decision = str(input("\nWrite results as 'Text' (output.txt) or 'Binary' (output.fib)?\n "))
+    if decision.upper() == "TEXT" or decision.upper() == "T":
+        return "text"
+    elif decision.upper() == "BINARY" or decision.upper() == "B":
+        return "binary"
+    else:
+        print("\n", decision, "is not a valid option.")
+        return get_output_format()
+
+
+
 
 # =========================================================================== #
-#                                Functions                                    #
+#                             Simulation Engine                               #
 # =========================================================================== #
 
-def run_again():
-    """ 
-    Prompt to input 'Q' to Quit, or 'R' to Restart the application.
+def draw_uniforms(rng, num_years, simulations_to_run, sampling='random'):
+    """Draw the uniform variates the shocks of every simulation are made from.
+
+    Args:
+        rng: numpy Generator used to draw the variates.
+        num_years: number of years in each simulation.
+        simulations_to_run: number of simulations to draw variates for.
+        sampling: one of SAMPLING_SCHEMES:
+            'random': independent pseudo-random variates.
+            'antithetic': the first half of the simulations are pseudo-random,
+                the second half mirror them, u becomes 1 - u.
+            'qmc': points of a rank-1 lattice (Kronecker sequence) with one
+                coordinate per shock, all shifted by a single random vector
+                modulo 1 (Cranley-Patterson rotation).
+    Returns:
+        An array of shape (num_years, 2, simulations_to_run) of values in [0, 1).
+    Explanation:
+        Every scheme draws each variate uniformly, so the estimates are
+        unbiased, but antithetic pairs and lattice points cover [0, 1) more
+        evenly than independent draws, lowering the variance of the success
+        rate. The simulations of a shard are then not independent, only
+        shards are, see fold_summary().
     """
-    decision = str(input("--------------------------\nWhat would you like to do?\n'Quit' or 'Restart'?\n "))
-    if decision.upper() == "QUIT" or decision.upper() == "Q":
-        print("--------------------------\nfi.py has closed.\n--------------------------")
-        quit()
-    elif decision.upper() == "RESTART" or decision.upper() == "R":
-        print("--------------------------\nfi.py has restarted.\n--------------------------")
-        begin()
-    else:
-        print("--------------------------\n\n", decision, "is not a valid option.\n")
-        run_again()
+    shape = (num_years, 2, simulations_to_run)
+    if sampling == 'antithetic':
+        half = rng.random((num_years, 2, (simulations_to_run + 1) // 2))
+        return np.concatenate((half, 1 - half), axis=2)[:, :, :simulations_to_run]
+    if sampling == 'qmc':
+        shift = rng.random((num_years, 2, 1))
+        points = lattice_generator(2 * num_years).reshape(num_years, 2, 1) * (
+                np.arange(1, simulations_to_run + 1))
+        return np.remainder(points + shift, 1.0)
+    return rng.random(shape)
 
 
-def run_simulation(annual_spend, inflation_rate, savings_balance,
-            interest_rate, num_years, inflation_change, interest_change):
-    """ 
-    Calculates savings_balance value after yearly expenses, taking into account 
-    interest and inflation rates. Interest and inflation values undergo randomization each iteration.
+def lattice_generator(dimensions):
+    """Return the generating vector of the Kronecker sequence in dimensions.
+
+    Explanation:
+        Coordinate j is the fractional part of phi ** -(j + 1), where phi is
+        the unique positive root of x ** (dimensions + 1) = x + 1, which
+        spreads the points evenly in every dimension (the R sequence).
+    """
+    phi = 2.0
+    for i in range(100):
+        phi = (1 + phi) ** (1 / (dimensions + 1))
+    return np.remainder(phi ** -np.arange(1.0, dimensions + 1), 1.0)
+
+
+def draw_shocks(rng, num_years, simulations_to_run, sampling='random'):
+    """Draw the random inflation and interest shocks for every simulation.
+
+    Args:
+        rng: numpy Generator used to draw the shocks.
+        num_years: number of years in each simulation.
+        simulations_to_run: number of simulations to draw shocks for.
+        sampling: scheme the variates are drawn with, see draw_uniforms().
+    Returns:
+        An array of shape (num_years, 2, simulations_to_run), index 0 of the
+        middle axis holds the inflation shocks and index 1 the interest shocks.
+    Explanation:
+        Each shock has the same distribution as the one used by modify_rate(),
+        0.75 - random() * 2.5, a value between -1.75 and 0.75. The array is
+        year-major so the draws for a single year are contiguous in memory.
+    """
+    return 0.75 - draw_uniforms(rng, num_years, simulations_to_run, sampling) * 2.5
+
+
+def iterate_shocks(rng, num_years, simulations_to_run, sampling='random'):
+    """Yield the (2, simulations_to_run) shocks of each year in turn, the same
+    values draw_shocks() returns, drawing them from rng only when asked for.
+
+    Explanation:
+        Every scheme draws its variates year-major, so drawing them a year at
+        a time consumes the same stream. The random shift of the lattice is
+        drawn for every year with the first year, as draw_uniforms() does.
+    """
+    if sampling == 'qmc':
+        shift = rng.random((num_years, 2, 1))
+        generator = lattice_generator(2 * num_years).reshape(num_years, 2, 1)
+        points = np.arange(1, simulations_to_run + 1)
+    for year in range(num_years):
+        if sampling == 'antithetic':
+            half = rng.random((2, (simulations_to_run + 1) // 2))
+            uniforms = np.concatenate((half, 1 - half), axis=1)[:, :simulations_to_run]
+        elif sampling == 'qmc':
+            uniforms = np.remainder(generator[year] * points + shift[year], 1.0)
+        else:
+            uniforms = rng.random((2, simulations_to_run))
+        yield 0.75 - uniforms * 2.5
+
+
+def run_simulations(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, rng=None, stop_on_ruin=False, timer=None,
+            history=None, sampling='random'):
+    """
+    Batch equivalent of run_simulation(), computes every simulation at once
+    using array operations instead of stepping one simulation at a time.
 
     Args:
         annual_spend,
@@ -222,115 +436,3174 @@ def run_simulation(annual_spend, inflation_rate, savings_balance,
         num_years,
         inflation_change,
         interest_change:
-        Validated values input by the user.
-    Returns: 
-        An array of floats, representing the users saving balance after spending, interest and inflation.
+        Validated values input by the user, as for run_simulation().
+        simulations_to_run: number of simulations to compute.
+        rng: optional numpy Generator, a freshly seeded one is used if omitted.
+        stop_on_ruin: stop stepping a simulation once its balance is negative.
+        timer: optional StageTimer, the time spent drawing shocks, computing
+            rates and stepping balances is added to it.
+        history: optional (rates, blocks) tuple returned by load_history(),
+            the rates are then block-bootstrapped from history instead of
+            random walks, see bootstrap_rates().
+        sampling: scheme the shocks are drawn with, see draw_uniforms(). Not
+            used with history.
+    Returns:
+        An array of shape (simulations_to_run, num_years), row i holds the
+        savings balances of simulation i after spending, interest and inflation.
+        With stop_on_ruin, a simulation's balance stays at the first negative
+        value for the rest of its years.
     Explanation:
-    Loop for int(num_years):
-        annual_spend is adjusted by inflation_rate. 
-        Adjusted annual_spend is subtracted from savings_balance.
-        interest_rate is applied to remaining savings_balance.
-        Final savings_balance is appended to ???San array.
-    End loop.
-    return array.
+        All shocks are drawn up front by draw_shocks().
+        The rate used in year n is the base rate plus the first n shocks
+        (run_simulation() modifies the rates after they are used), so both
+        rate paths are a cumulative sum over the year axis.
+        annual_spend compounds by the cumulative product of (1 + inflation).
+        savings_balance is stepped one year at a time across all simulations,
+        the recurrence subtracts before it compounds so it cannot be rewritten
+        as a single cumulative product without dividing by growth factors that
+        overflow or reach zero over long horizons.
+        With stop_on_ruin, see _run_simulations_until_ruin(), the rates and
+        spending are built up a year at a time instead, and depleted
+        simulations are dropped from them, so they cost nothing in later years.
+        With history, each year's rates are taken from a historical year and
+        the base rates and changes are not used.
     """
-    results = []
-    for i in range(0, num_years):
-        annual_spend = annual_spend + (annual_spend * inflation_rate)
-        savings_balance = savings_balance - annual_spend
-        savings_balance = savings_balance + (savings_balance * interest_rate)
+    if rng is None:
+        rng = np.random.default_rng()
+    if stop_on_ruin:
+        return _run_simulations_until_ruin(annual_spend, inflation_rate,
+                savings_balance, interest_rate, num_years, inflation_change,
+                interest_change, simulations_to_run, rng, timer, history, sampling)
 
-        inflation_rate = modify_rate(inflation_rate, inflation_change)
-        interest_rate = modify_rate(interest_rate, interest_change)
+    if timer is not None:
+        start = time.perf_counter()
+    if history is not None:
+        rates = bootstrap_rates(rng, history, num_years, simulations_to_run)
+        if timer is not None:
+            timer.add('random', time.perf_counter() - start, simulations_to_run)
+            start = time.perf_counter()
+    else:
+        # Turn the shocks into rates in place, year 0 uses the base rates and
+        # the final year's shocks are drawn, as in run_simulation(), but never
+        # used.
+        rates = draw_shocks(rng, num_years, simulations_to_run, sampling)
+        if timer is not None:
+            timer.add('random', time.perf_counter() - start, rates.size, 'draws')
+            start = time.perf_counter()
+        rates[1:] = rates[:-1] * [[inflation_change], [interest_change]]
+        rates[0] = [[inflation_rate], [interest_rate]]
+        np.cumsum(rates, axis=0, out=rates)
+    inflation_rates = rates[:, 0]
+    interest_rates = rates[:, 1]
 
-        results.append(savings_balance)
+    spending = annual_spend * np.cumprod(1 + inflation_rates, axis=0)
+    if timer is not None:
+        timer.add('rates', time.perf_counter() - start, simulations_to_run)
+        start = time.perf_counter()
 
-    return results
+    balances = np.empty((num_years, simulations_to_run))
+    balance = np.full(simulations_to_run, float(savings_balance))
+    for year in range(num_years):
+        balance -= spending[year]
+        balance += balance * interest_rates[year]
+        balances[year] = balance
+    if timer is not None:
+        timer.add('balances', time.perf_counter() - start, balances.size,
+                'balances')
+    return balances.T
 
 
-def modify_rate(rate, change):
+def _run_simulations_until_ruin(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, rng, timer=None, history=None, sampling='random'):
     """
-    Calculate a random value within change of the given rate
+    run_simulations() for the stop_on_ruin option, only the simulations that
+    have not been depleted are stepped.
+
+    Explanation:
+        As in _summarize_shard_until_ruin(), the shocks are drawn a year at a
+        time, see iterate_shocks(), from the same stream and in the same order
+        as draw_shocks() draws them, and the rates and spending of the
+        simulations still being stepped are updated from them with the same
+        arithmetic as the cumulative sum and product, so the balances are
+        those of run_simulations() up to each simulation's depletion. Once
+        every simulation is depleted nothing more is drawn or computed.
+        Bootstrapped rates are still drawn up front, a block covers several
+        years, but spending is only compounded for the simulations stepped.
+    """
+    random_time = 0
+    start = time.perf_counter()
+    if history is not None:
+        rates = bootstrap_rates(rng, history, num_years, simulations_to_run)
+    else:
+        shocks = iterate_shocks(rng, num_years, simulations_to_run, sampling)
+    random_time += time.perf_counter() - start
+
+    # 'active' holds the index of each simulation still being stepped, the
+    # other arrays only their state. Depleted simulations keep their last
+    # balance in 'frozen'.
+    active = np.arange(simulations_to_run)
+    inflation_rates = np.full(simulations_to_run, float(inflation_rate))
+    interest_rates = np.full(simulations_to_run, float(interest_rate))
+    growth = np.ones(simulations_to_run)
+    balance = np.full(simulations_to_run, float(savings_balance))
+    frozen = np.empty(simulations_to_run)
+    balances = np.empty((num_years, simulations_to_run))
+    draws = 0
+    for year in range(num_years):
+        if history is not None:
+            inflation_rates = rates[year, 0, active]
+            interest_rates = rates[year, 1, active]
+        growth *= 1 + inflation_rates
+        balance -= annual_spend * growth
+        balance += balance * interest_rates
+        frozen[active] = balance
+        balances[year] = frozen
+        if history is None:
+            draw_start = time.perf_counter()
+            year_shocks = next(shocks)
+            random_time += time.perf_counter() - draw_start
+            draws += year_shocks.size
+            if active.size < simulations_to_run:
+                year_shocks = year_shocks[:, active]
+            inflation_rates += inflation_change * year_shocks[0]
+            interest_rates += interest_change * year_shocks[1]
+
+        depleted = balance < 0
+        if depleted.any():
+            kept = ~depleted
+            active = active[kept]
+            inflation_rates = inflation_rates[kept]
+            interest_rates = interest_rates[kept]
+            growth = growth[kept]
+            balance = balance[kept]
+            if active.size == 0:
+                balances[year + 1:] = frozen
+                break
+
+    if timer is not None:
+        if history is None:
+            timer.add('random', random_time, draws, 'draws')
+        else:
+            timer.add('random', random_time, simulations_to_run)
+        timer.add('balances', time.perf_counter() - start - random_time,
+                balances.size, 'balances')
+    return balances.T
+
+
+def is_successful(final):
+    """Return whether each final balance is a success: not negative, and
+    finite, one that overflowed to infinity or NaN over a very long horizon
+    is not one."""
+    return np.isfinite(final) & (final >= 0)
+
+
+
+
+# =========================================================================== #
+#                            Historical Bootstrap                             #
+# =========================================================================== #
+
+def load_history(filename, block_size=5):
+    """
+    Load yearly historical inflation and returns for bootstrap_rates().
 
     Args:
-        rate: the initial rate to change from
-        change: the maximum amount to add or subtract from the rate
+        filename: path of a CSV file with a header row naming an 'inflation'
+            column and a 'return' (or 'interest') column, one row per year,
+            values as fractions, e.g. 0.03 for 3%. Other columns are ignored.
+        block_size: number of consecutive historical years in each block.
     Returns:
-        random value within change of the given rate
+        A tuple of a contiguous (2, years) array of the inflation and return of
+        each year, and a (years, block_size) array of block indexes, row i
+        holding the years of the block starting at year i.
+    Raises:
+        ValueError: if the file is missing a column, holds a value that is not
+            a number, or has fewer years than block_size.
     Explanation:
-        random.random() calculates a random value between 0 and 1.
-        Thus random.random() * 2 gives a value between 0 and 2,
-        so 1 - random.random() * 2 gives a value between -1 and 1.
-        Multiplying by change gives a value between -change and change,
-        which is then added to the rate.
+        Blocks wrap around from the last year to the first (circular block
+        bootstrap), so every year is equally likely to be drawn and any year
+        can start a block.
     """
-    return rate + change * (0.75 - random.random() * 2.5)
+    with open(filename, newline='') as f:
+        reader = csv.DictReader(f)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+        inflation = columns.get('inflation')
+        returns = columns.get('return', columns.get('interest'))
+        if inflation is None or returns is None:
+            raise ValueError(filename + " needs an 'inflation' and a 'return' column.")
+        try:
+            rows = [(float(row[inflation]), float(row[returns])) for row in reader]
+        except (TypeError, ValueError):
+            raise ValueError(filename + " holds a value that is not a number.")
+    rates = np.ascontiguousarray(np.array(rows, dtype=np.float64).reshape(-1, 2).T)
+    if not np.isfinite(rates).all():
+        raise ValueError(filename + " holds a value that is not a number.")
+    years = rates.shape[1]
+    if block_size <= 0 or years < block_size:
+        raise ValueError(filename + " has " + str(years) + " years, fewer than "
+                "the block size of " + str(block_size) + ".")
+    blocks = (np.arange(years)[:, None] + np.arange(block_size)) % years
+    return rates, blocks
 
 
-def begin():
+def bootstrap_rates(rng, history, num_years, simulations_to_run):
     """
-    Will cause the application to prompt user for input, validate, store
-    and process the input. 
+    Draw the inflation and interest rates of every simulation by joining
+    randomly chosen blocks of historical years.
+
+    Args:
+        rng: numpy Generator used to choose the blocks.
+        history: (rates, blocks) tuple returned by load_history().
+        num_years: number of years in each simulation.
+        simulations_to_run: number of simulations to draw rates for.
+    Returns:
+        An array of shape (num_years, 2, simulations_to_run) of rates, laid out
+        as the shocks of draw_shocks().
+    Explanation:
+        A year's inflation and return always come from the same historical
+        year, keeping their correlation, and consecutive years within a block
+        keep the autocorrelation of each. Sampling is only indexing: one
+        integer per block and simulation picks a row of the precomputed block
+        index, and the rates are gathered with a single take().
+    """
+    rates, blocks = history
+    years, block_size = blocks.shape
+    starts = rng.integers(years, size=(-(-num_years // block_size), simulations_to_run))
+    # (blocks drawn, block_size, simulations) flattened to one year per row.
+    indexes = blocks[starts].transpose(0, 2, 1).reshape(-1, simulations_to_run)
+    return np.take(rates, indexes[:num_years], axis=1).transpose(1, 0, 2)
+
 
-    Processed data is written to file 'output.txt' which will be created and stored
-    in the same directory as 'fi.py'.
+
+
+# =========================================================================== #
+#                            Parallel Execution                               #
+# =========================================================================== #
+
+def shard_sizes(simulations_to_run, shard_size=SHARD_SIZE):
+    """Split simulations_to_run into shards of shard_size simulations.
+
+    Args:
+        simulations_to_run: total number of simulations.
+        shard_size: number of simulations in a full shard.
+    Returns:
+        A list of shard sizes, all shard_size except possibly the last.
+    """
+    sizes = [shard_size] * (simulations_to_run // shard_size)
+    if simulations_to_run % shard_size:
+        sizes.append(simulations_to_run % shard_size)
+    return sizes
+
+
+def shard_seed(seed, index):
+    """Derive the independent seed of a shard from the master seed.
+
+    Args:
+        seed: master seed supplied by the user.
+        index: position of the shard in the run.
+    Returns:
+        A numpy SeedSequence, identical to the index'th child spawned from
+        SeedSequence(seed), so a shard's stream depends only on the master
+        seed and its position.
+    """
+    return np.random.SeedSequence(seed, spawn_key=(index,))
+
+
+def map_shards(function, jobs, workers=None, executor=None):
+    """Apply function to each job, in a pool of worker processes.
+
+    Args:
+        function: top level function taking a single job, so it can be pickled.
+        jobs: iterable of jobs.
+        workers: number of worker processes, defaults to the number of CPUs.
+            With a single worker and no executor the jobs run in the current
+            process.
+        executor: optional running ProcessPoolExecutor to submit the jobs to,
+            instead of starting a pool for them, workers then only limits how
+            many are queued.
+    Yields:
+        The result of each job, in the same order as jobs.
+    Explanation:
+        At most two jobs per worker are queued at once, so results waiting to
+        be consumed do not pile up in memory on long runs. Queued jobs not yet
+        started are cancelled when the generator is closed.
     """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if executor is not None:
+        yield from _submit_shards(executor, function, jobs, workers)
+        return
+    if workers == 1:
+        for job in jobs:
+            yield function(job)
+        return
 
-    # Confirm the file 'output.txt' can be opened or created, and written to.
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from _submit_shards(executor, function, jobs, workers)
+
+
+def _submit_shards(executor, function, jobs, workers):
+    """Yield the result of each job submitted to executor, keeping at most
+    two jobs per worker queued, for map_shards()."""
+    pending = []
     try:
-        with open('output.txt', '+w') as f:
-            f.write("")
-    # Instruct user how to resolve the error then close the application.            
-    except IOError:
-        input("\nError accessing output.txt from:\n" + os.getcwd() +
-        "\nCheck you have permissions to read and write to files in this " +
-        "directory then try again.\n\nPress and 'Enter' or 'Return' to quit the application.")
-        quit()
+        for job in jobs:
+            pending.append(executor.submit(function, job))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        while pending:
+            yield pending.pop(0).result()
+    finally:
+        for future in pending:
+            future.cancel()
 
-    # Get values from the user to so the calculations can be run.
-    annual_spend = get_annual_spend()
-    inflation_rate = get_inflation_rate()
-    inflation_change = get_inflation_change()
-    savings_balance = get_savings_balance()
-    interest_rate = get_interest_rate()
-    interest_change = get_interest_change()
-    num_years = get_num_years()
-    simulations_to_run = get_simulations_to_run()
 
-    # Used to determin the percentage of simulations which end with a positive number.
-    successful_count = 0
-    # Loop for the number of simulations the user requested.
-    for i in range(0, simulations_to_run):
-        # 'run_simulation' returns an array of savings balances remaining after
-        # expenses for each year have been calculated and deducted.
-        result = run_simulation(annual_spend, inflation_rate, savings_balance,
-                interest_rate, num_years, inflation_change, interest_change)
+def run_shards(function, parameters, simulations_to_run, seed, workers=None,
+            options=None, first_shard=0):
+    """Split a run into shards and apply function to each in map_shards().
+
+    Args:
+        function: top level function taking a (parameters, seed, size, options)
+            job.
+        parameters: tuple of the seven run_simulation() arguments.
+        simulations_to_run: total number of simulations.
+        seed: master seed, each shard's seed is derived from it by shard_seed().
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options passed to each shard:
+            'stop_on_ruin': stop stepping simulations once depleted, see
+                run_simulations().
+            'timer': StageTimer the time spent in each stage of every shard
+                is added to, see _timed_shard(). It is not sent to the shards.
+            'history': historical rates to bootstrap instead of random walks,
+                see load_history().
+            'sampling': scheme the shocks are drawn with, see draw_uniforms().
+            'executor': running ProcessPoolExecutor the shards are submitted
+                to, so a long lived process can keep one warm pool for every
+                run, see map_shards(). It is not sent to the shards.
+            'shard_size': number of simulations in a shard, defaults to
+                SHARD_SIZE. The random streams depend on it, see plan_memory().
+            'dtype', 'year_step': type and years the balances of a binary
+                output file are stored in, see _compact_shard().
+        first_shard: position of the first shard in the run, so more
+            simulations can be added to a run without repeating its streams.
+    Returns:
+        An iterator over the result of each shard, in shard order.
+    """
+    if options is None:
+        options = {}
+    timer = options.get('timer')
+    executor = options.get('executor')
+    if timer is not None or executor is not None:
+        options = {name: value for name, value in options.items()
+                if name not in ('timer', 'executor')}
+    jobs = [(parameters, shard_seed(seed, first_shard + index), size, options)
+            for index, size in enumerate(shard_sizes(simulations_to_run,
+            options.get('shard_size', SHARD_SIZE)))]
+    # A pool is not worth starting for a single shard.
+    if len(jobs) == 1 and executor is None:
+        workers = 1
+    if timer is None:
+        return map_shards(function, jobs, workers, executor)
+    return _timed_results(map_shards(_timed_shard,
+            [(function, job) for job in jobs], workers, executor), timer)
+
+
+def _run_shard(job):
+    """Run run_simulations() for a single shard job."""
+    parameters, seed, size, options = job
+    return run_simulations(*parameters, size, rng=np.random.default_rng(seed),
+            stop_on_ruin=options.get('stop_on_ruin', False),
+            timer=options.get('timer'), history=options.get('history'),
+            sampling=options.get('sampling', 'random'))
+
+
+def iterate_results(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, workers=None, options=None):
+    """
+    Run simulations_to_run simulations split into shards across worker processes.
+
+    Args:
+        annual_spend,
+        inflation_rate,
+        savings_balance,
+        interest_rate,
+        num_years,
+        inflation_change,
+        interest_change:
+        Validated values input by the user, as for run_simulation().
+        simulations_to_run: number of simulations to compute.
+        seed: master seed, each shard's seed is derived from it by shard_seed().
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options, see run_shards().
+    Returns:
+        An iterator over the (shard size, num_years) balance array of each
+        shard, in shard order. The results are the same for any number of
+        workers.
+    """
+    parameters = (annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change)
+    return run_shards(_run_shard, parameters, simulations_to_run, seed, workers,
+            options)
+
+
+def run_parallel(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, workers=None, options=None):
+    """
+    Run simulations_to_run simulations split into shards across worker
+    processes, see iterate_results().
+
+    Returns:
+        An array of shape (simulations_to_run, num_years), as for
+        run_simulations(). The result is the same for any number of workers.
+    """
+    return np.concatenate(list(iterate_results(annual_spend, inflation_rate,
+            savings_balance, interest_rate, num_years, inflation_change,
+            interest_change, simulations_to_run, seed, workers, options)))
 
-        # Open the file 'output.txt' in append mode.
-        # For each value in results array, format to two decimal places and
-        # append if to the file. If the last result was positive, append
-        # 'successful', else append 'unsuccessful'.
-        with open('output.txt', 'a') as f:
-            for val in result:
-                f.write(format(val, '.2f') + " ")
-            if float(result[len(result)-1]) < 0:
-                f.write("unsuccessful")
+
+
+# =========================================================================== #
+#                                  Profiling                                  #
+# =========================================================================== #
+
+class StageTimer:
+    """
+    Wall time, number of calls and amount of work of each stage of a run.
+
+    Explanation:
+        stages maps a stage name to [calls, seconds, items, unit], where items
+        counts the work done in the unit given, e.g. 'draws' or 'bytes'.
+        Engine functions only time their stages when given a timer, so a run
+        without --profile pays nothing but a None check per shard or year.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds, items=0, unit='paths'):
+        """Add a call of stage that took seconds and processed items."""
+        self.merge({stage: [1, seconds, items, unit]})
+
+    def merge(self, stages):
+        """Add the stages of another StageTimer to this one."""
+        for stage, (calls, seconds, items, unit) in stages.items():
+            totals = self.stages.setdefault(stage, [0, 0.0, 0, unit])
+            totals[0] += calls
+            totals[1] += seconds
+            totals[2] += items
+
+    def report(self, f=sys.stdout):
+        """Write the time, calls and throughput of each stage to f."""
+        print("\n----------------------------------------------", file=f)
+        print("{0:<10}{1:>8}{2:>12}  {3}".format("Stage", "Calls", "Seconds",
+            "Throughput"), file=f)
+        for stage, (calls, seconds, items, unit) in self.stages.items():
+            rate = items / max(seconds, 1e-9)
+            if unit == 'bytes':
+                throughput = format(rate / 1e6, '.2f') + " MB/s"
             else:
-                f.write("successful")
-                successful_count  += 1
-            f.write("\n")
+                throughput = format(rate, '.4g') + " " + unit + "/s"
+            print("{0:<10}{1:>8}{2:>12.3f}  {3}".format(stage, calls, seconds,
+                throughput), file=f)
+        print("Shard stages are summed over every worker process, so they can "
+            "add up to more than the total.", file=f)
+        print("----------------------------------------------", file=f)
 
-    # Calculate the percent of successful results, and write to the console.
-    percent = (successful_count/simulations_to_run)*100
-    print("\n----------------------------------------------")
-    print("Simulation was successful in " + str(successful_count) + "/" +
-        str(simulations_to_run) + " runs " + "(" + format(percent, '.2f') + "%)")
+
+def _timed_shard(job):
+    """
+    Run a shard job with a StageTimer of its own.
+
+    Args:
+        job: tuple of the shard function and its (parameters, seed, size,
+            options) job.
+    Returns:
+        A tuple of the shard's result and its timer's stages, which are sent
+        back to the parent process with the result.
+    """
+    function, (parameters, seed, size, options) = job
+    timer = StageTimer()
+    start = time.perf_counter()
+    result = function((parameters, seed, size, dict(options, timer=timer)))
+    timer.add('shard', time.perf_counter() - start, size)
+    return result, timer.stages
+
+
+def _timed_results(results, timer):
+    """Yield the results of _timed_shard() jobs, merging their stages into
+    timer along with the time spent waiting for each one."""
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                result, stages = next(results)
+            except StopIteration:
+                return
+            timer.add('wait', time.perf_counter() - start, 1, 'shards')
+            timer.merge(stages)
+            yield result
+    finally:
+        results.close()
+
+
+
+
+# =========================================================================== #
+#                            Streaming Statistics                             #
+# =========================================================================== #
+
+class QuantileSketch:
+    """Mergeable, fixed accuracy sketch of the quantiles of a stream of values.
+
+    Values are counted in logarithmically sized buckets, any quantile returned
+    is within relative_accuracy of the true value. Memory depends only on the
+    range of the values, not on how many are added.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Bucket index -> count, for the magnitudes of positive and negative values.
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        # NaN values cannot be ranked, they are only counted.
+        self.nan = 0
+
+    def _add_buckets(self, buckets, magnitudes):
+        indexes = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        keys, counts = np.unique(indexes, return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+    def add(self, values):
+        """Add an array of values to the sketch, NaN values are counted in nan
+        but not ranked."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        nan = np.isnan(values)
+        self.nan += int(np.count_nonzero(nan))
+        values = values[~nan]
+        # Infinite balances are counted in the largest finite bucket.
+        values = np.clip(values, -np.finfo(np.float64).max, np.finfo(np.float64).max)
+        self.count += values.size
+        self.zero += int(np.count_nonzero(values == 0))
+        self._add_buckets(self.positive, values[values > 0])
+        self._add_buckets(self.negative, -values[values < 0])
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same accuracy."""
+        for buckets, other_buckets in ((self.positive, other.positive),
+                                       (self.negative, other.negative)):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.nan += other.nan
+
+    def quantile(self, q):
+        """Return the estimated q quantile (0 <= q <= 1) of the values that are
+        not NaN, or None if there are none."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Walk the buckets in ascending order of value: negatives from the
+        # largest magnitude down, then zero, then positives.
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive))
+
+    def _bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def to_dict(self):
+        """Return the sketch as a dictionary that can be saved as JSON."""
+        return {'relative_accuracy': self.relative_accuracy,
+                'positive': list(self.positive.items()),
+                'negative': list(self.negative.items()),
+                'zero': self.zero, 'count': self.count, 'nan': self.nan}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the sketch saved by to_dict()."""
+        sketch = cls(data['relative_accuracy'])
+        sketch.positive = dict(data['positive'])
+        sketch.negative = dict(data['negative'])
+        sketch.zero = data['zero']
+        sketch.count = data['count']
+        sketch.nan = data.get('nan', 0)
+        return sketch
+
+
+class YearlyQuantileSketch:
+    """Mergeable sketch of the quantiles of the balance in each of a set of
+    years, over a stream of simulations.
+
+    Like QuantileSketch, values are counted in logarithmically sized buckets,
+    but every year has the same fixed buckets, held in a single array, so a
+    whole block of simulations is added with one bincount(). Magnitudes below
+    smallest are counted as zero and above largest as largest.
+    """
+
+    def __init__(self, years, relative_accuracy=0.01, smallest=1.0, largest=1e15):
+        self.years = np.asarray(years, dtype=np.int64)
+        self.smallest = smallest
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Buckets per sign, index 'magnitudes' counts zero, lower indexes
+        # negative values and higher indexes positive values, in value order.
+        self.magnitudes = int(math.ceil(math.log(largest / smallest) / self.log_gamma))
+        self.counts = np.zeros((self.years.size, 2 * self.magnitudes + 1),
+                dtype=np.int64)
+
+    def add(self, values):
+        """
+        Add a block of simulations to the sketch.
+
+        Args:
+            values: array of shape (simulations, len(years)), the balance of
+                each simulation in each of the sketch's years. NaN values are
+                ignored.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keys = np.ceil(np.log(np.abs(values) / self.smallest) / self.log_gamma)
+        keys = np.clip(np.nan_to_num(keys, nan=0, neginf=0), 0, self.magnitudes)
+        buckets = self.magnitudes + np.where(values < 0, -keys, keys).astype(np.int64)
+        buckets += np.arange(self.years.size) * self.counts.shape[1]
+        buckets = buckets[~np.isnan(values)]
+        self.counts += np.bincount(buckets, minlength=self.counts.size).reshape(
+                self.counts.shape)
+
+    def merge(self, other):
+        """Add the counts of another sketch of the same years and buckets."""
+        self.counts += other.counts
+
+    def quantiles(self, qs):
+        """Return an array of shape (len(qs), len(years)) of the estimated q
+        quantile of each year, for each q in qs. NaN for years with no values."""
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        keys = np.arange(self.counts.shape[1]) - self.magnitudes
+        bucket_values = np.sign(keys) * (2 * self.smallest *
+                self.gamma ** np.abs(keys) / (self.gamma + 1))
+        result = np.full((len(qs), self.years.size), np.nan)
+        for i, q in enumerate(qs):
+            # First bucket whose cumulative count passes the rank, per year.
+            rank = q * (total - 1)
+            buckets = (cumulative > rank[:, None]).argmax(axis=1)
+            result[i] = np.where(total > 0, bucket_values[buckets], np.nan)
+        return result
+
+
+def band_years(num_years, most=BAND_YEARS):
+    """Return the years, counting from 0, the fan chart bands are computed for,
+    every year, or most evenly spaced years including the first and last."""
+    return np.unique(np.linspace(0, num_years - 1, min(num_years, most)).round()
+            .astype(np.int64))
+
+
+def _summarize_shard(job):
+    """
+    Step a single shard one year at a time, keeping only per-simulation
+    accumulators instead of every year's balance.
+
+    Args:
+        job: tuple of (parameters, seed, size, options) as for _run_shard().
+    Returns:
+        A dictionary of arrays with one element per simulation: 'final',
+        'minimum', 'maximum' and 'mean' balances, and 'depletion_year', the
+        first year (counting from 1) the balance was negative, or -1.
+    Explanation:
+        The shocks are drawn a year at a time from the same stream, in the same
+        order, as run_simulations() draws them, and the arithmetic is the same,
+        so both produce the same balances for the same seed.
+    """
+    parameters, seed, size, options = job
+    (annual_spend, inflation_rate, savings_balance, interest_rate, num_years,
+            inflation_change, interest_change) = parameters
+    # Bootstrapped rates are drawn a block at a time, and antithetic or lattice
+    # variates for the whole shard at once, so they cannot be stepped a year at
+    # a time from the same stream. Shards are small enough to summarize from
+    # their full matrix.
+    if (options.get('history') is not None or
+            options.get('sampling', 'random') != 'random'):
+        return summarize_balances(_run_shard(job))
+    if options.get('stop_on_ruin'):
+        return _summarize_shard_until_ruin(job)
+    rng = np.random.default_rng(seed)
+    timer = options.get('timer')
+    random_time = 0
+    start = time.perf_counter()
+
+    inflation_rates = np.full(size, float(inflation_rate))
+    interest_rates = np.full(size, float(interest_rate))
+    growth = np.ones(size)
+    balance = np.full(size, float(savings_balance))
+    minimum = np.full(size, np.inf)
+    maximum = np.full(size, -np.inf)
+    total = np.zeros(size)
+    depletion_year = np.full(size, -1)
+
+    for year in range(num_years):
+        if timer is not None:
+            draw_start = time.perf_counter()
+        shocks = draw_shocks(rng, 1, size)[0]
+        if timer is not None:
+            random_time += time.perf_counter() - draw_start
+        growth *= 1 + inflation_rates
+        balance -= annual_spend * growth
+        balance += balance * interest_rates
+        inflation_rates += inflation_change * shocks[0]
+        interest_rates += interest_change * shocks[1]
+
+        np.minimum(minimum, balance, out=minimum)
+        np.maximum(maximum, balance, out=maximum)
+        total += balance
+        depletion_year[(balance < 0) & (depletion_year < 0)] = year + 1
+
+    if timer is not None:
+        timer.add('random', random_time, 2 * num_years * size, 'draws')
+        timer.add('balances', time.perf_counter() - start - random_time,
+                num_years * size, 'balances')
+    return {'final': balance, 'minimum': minimum, 'maximum': maximum,
+            'mean': total / num_years, 'depletion_year': depletion_year}
+
+
+def _summarize_shard_until_ruin(job):
+    """
+    _summarize_shard() for the stop_on_ruin option, only the simulations that
+    have not been depleted are stepped.
+
+    Explanation:
+        As in run_simulations(), a depleted simulation's balance stays at its
+        first negative value, which then counts towards its mean for each
+        remaining year. Its minimum and maximum can no longer change.
+    """
+    parameters, seed, size, options = job
+    (annual_spend, inflation_rate, savings_balance, interest_rate, num_years,
+            inflation_change, interest_change) = parameters
+    rng = np.random.default_rng(seed)
+    timer = options.get('timer')
+    random_time = 0
+    start = time.perf_counter()
+
+    # Per simulation results, filled in as simulations are depleted.
+    final = np.empty(size)
+    minimum = np.empty(size)
+    maximum = np.empty(size)
+    total = np.empty(size)
+    depletion_year = np.full(size, -1)
+
+    # State of the simulations still being stepped, indexed by 'active'.
+    active = np.arange(size)
+    inflation_rates = np.full(size, float(inflation_rate))
+    interest_rates = np.full(size, float(interest_rate))
+    growth = np.ones(size)
+    balance = np.full(size, float(savings_balance))
+    active_minimum = np.full(size, np.inf)
+    active_maximum = np.full(size, -np.inf)
+    active_total = np.zeros(size)
+
+    for year in range(num_years):
+        if timer is not None:
+            draw_start = time.perf_counter()
+        # Shocks are drawn for every simulation to keep the random stream the
+        # same as run_simulations().
+        shocks = draw_shocks(rng, 1, size)[0][:, active]
+        if timer is not None:
+            random_time += time.perf_counter() - draw_start
+        growth *= 1 + inflation_rates
+        balance -= annual_spend * growth
+        balance += balance * interest_rates
+        inflation_rates += inflation_change * shocks[0]
+        interest_rates += interest_change * shocks[1]
+
+        np.minimum(active_minimum, balance, out=active_minimum)
+        np.maximum(active_maximum, balance, out=active_maximum)
+        active_total += balance
+
+        depleted = balance < 0
+        if depleted.any():
+            indexes = active[depleted]
+            final[indexes] = balance[depleted]
+            minimum[indexes] = active_minimum[depleted]
+            maximum[indexes] = active_maximum[depleted]
+            total[indexes] = active_total[depleted] + balance[depleted] * (num_years - year - 1)
+            depletion_year[indexes] = year + 1
+
+            kept = ~depleted
+            active = active[kept]
+            inflation_rates = inflation_rates[kept]
+            interest_rates = interest_rates[kept]
+            growth = growth[kept]
+            balance = balance[kept]
+            active_minimum = active_minimum[kept]
+            active_maximum = active_maximum[kept]
+            active_total = active_total[kept]
+            # Nothing left to step, the rest of the stream is never used.
+            if active.size == 0:
+                break
+
+    final[active] = balance
+    minimum[active] = active_minimum
+    maximum[active] = active_maximum
+    total[active] = active_total
+    if timer is not None:
+        timer.add('random', random_time, 2 * (year + 1) * size, 'draws')
+        timer.add('balances', time.perf_counter() - start - random_time,
+                num_years * size, 'balances')
+    return {'final': final, 'minimum': minimum, 'maximum': maximum,
+            'mean': total / num_years, 'depletion_year': depletion_year}
+
+
+def summarize_balances(balances):
+    """Compute the same per-simulation accumulators as _summarize_shard()
+    from a (simulations, years) balance matrix."""
+    depleted = balances < 0
+    depletion_year = np.where(depleted.any(axis=1), depleted.argmax(axis=1) + 1, -1)
+    return {'final': balances[:, -1], 'minimum': balances.min(axis=1),
+            'maximum': balances.max(axis=1), 'mean': balances.mean(axis=1),
+            'depletion_year': depletion_year}
+
+
+def iterate_summaries(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, workers=None, options=None):
+    """
+    Run simulations_to_run simulations in shards, as run_parallel() does,
+    without ever holding a full balance matrix.
+
+    Yields:
+        The per-simulation accumulators of each shard, see _summarize_shard(),
+        in shard order.
+    """
+    parameters = (annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change)
+    return run_shards(_summarize_shard, parameters, simulations_to_run, seed,
+            workers, options)
+
+
+def new_summary(num_years, sampling='random'):
+    """Return empty run-wide accumulators for fold_summary(), of a run whose
+    shocks are drawn with sampling, see draw_uniforms()."""
+    return {'simulations': 0, 'successful': 0, 'sampling': sampling,
+            'units': 0, 'unit_total': 0.0, 'unit_squares': 0.0,
+            'minimum': np.inf, 'maximum': -np.inf, 'mean_total': 0.0,
+            'final_balance': QuantileSketch(), 'non_finite': 0,
+            'depletion_years': np.zeros(num_years + 1, dtype=np.int64)}
+
+
+def fold_summary(summary, shard):
+    """Fold a shard's per-simulation accumulators into the run-wide summary.
+
+    Args:
+        summary: accumulators returned by new_summary().
+        shard: per-simulation accumulators, see _summarize_shard().
+    Explanation:
+        A simulation is successful if its final balance is not negative, as in
+        begin(). depletion_years[n] counts the simulations first depleted in
+        year n, depletion_years[0] those never depleted.
+        The standard error of the success rate is estimated from independent
+        units, see success_units(), whose count, sum and sum of squares are
+        kept in 'units', 'unit_total' and 'unit_squares'.
+        'non_finite' counts the final balances that overflowed to infinity or
+        NaN, which happens over horizons of a few thousand years.
+    """
+    successful = is_successful(shard['final'])
+    units = success_units(successful, summary.get('sampling', 'random'))
+    summary['units'] = summary.get('units', 0) + units.size
+    summary['unit_total'] = summary.get('unit_total', 0.0) + float(units.sum())
+    summary['unit_squares'] = summary.get('unit_squares', 0.0) + float(
+            np.square(units).sum())
+    summary['simulations'] += shard['final'].size
+    summary['successful'] += int(np.count_nonzero(successful))
+    summary['non_finite'] = summary.get('non_finite', 0) + int(
+            np.count_nonzero(~np.isfinite(shard['final'])))
+    summary['minimum'] = min(summary['minimum'], float(shard['minimum'].min()))
+    summary['maximum'] = max(summary['maximum'], float(shard['maximum'].max()))
+    summary['mean_total'] += float(shard['mean'].sum())
+    summary['final_balance'].add(shard['final'])
+    summary['depletion_years'] += np.bincount(np.maximum(shard['depletion_year'], 0),
+            minlength=summary['depletion_years'].size)
+
+
+def success_units(successful, sampling='random'):
+    """
+    Return the success rate of each independent unit of a shard's simulations.
+
+    Args:
+        successful: array of the success flag of each simulation of a shard.
+        sampling: scheme the shard's shocks were drawn with, see draw_uniforms().
+    Explanation:
+        Random simulations are each a unit. Antithetic simulations are paired
+        with their mirror, as laid out by draw_uniforms(), the first half of an
+        odd shard's last simulation has no mirror and is a unit of its own.
+        Lattice points are only independent between shards, so a 'qmc' shard
+        is a single unit.
+    """
+    successful = np.asarray(successful, dtype=np.float64)
+    if sampling == 'antithetic':
+        half = (successful.size + 1) // 2
+        mirrored = successful.size - half
+        return np.concatenate(((successful[:mirrored] + successful[half:]) / 2,
+                successful[mirrored:half]))
+    if sampling == 'qmc':
+        return successful.mean(keepdims=True)
+    return successful
+
+
+def success_standard_error(summary):
+    """Return the standard error of a summary's success rate, or None if it
+    holds fewer than two independent units, see fold_summary()."""
+    units = summary.get('units', 0)
+    if units < 2:
+        return None
+    mean = summary['unit_total'] / units
+    variance = (summary['unit_squares'] - units * mean * mean) / (units - 1)
+    return math.sqrt(max(variance, 0.0) / units)
+
+
+def student_t_quantile(p, degrees):
+    """
+    Return the p quantile of Student's t distribution with degrees degrees of
+    freedom.
+
+    Explanation:
+        Cornish-Fisher expansion of t around the normal quantile (Abramowitz
+        and Stegun 26.7.5), within 0.1% of the exact value from 5 degrees of
+        freedom, which MIN_UNITS guarantees where it is used.
+    """
+    z = NormalDist().inv_cdf(p)
+    terms = ((z ** 3 + z) / 4,
+            (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+            (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+            (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z)
+            / 92160)
+    return z + sum(term / degrees ** (n + 1) for n, term in enumerate(terms))
+
+
+def success_half_width(summary, confidence):
+    """Return the half width of the confidence interval of a summary's success
+    rate, Student's t quantile times its standard error, or None if it holds
+    fewer than MIN_UNITS independent units."""
+    standard_error = success_standard_error(summary)
+    if standard_error is None or summary['units'] < MIN_UNITS:
+        return None
+    return student_t_quantile(1 - (1 - confidence) / 2,
+            summary['units'] - 1) * standard_error
+
+
+def summary_to_dict(summary):
+    """Return a summary as a dictionary that can be saved as JSON."""
+    return dict(summary, final_balance=summary['final_balance'].to_dict(),
+            depletion_years=summary['depletion_years'].tolist())
+
+
+def summary_from_dict(data):
+    """Return the summary saved by summary_to_dict()."""
+    return dict(data, final_balance=QuantileSketch.from_dict(data['final_balance']),
+            depletion_years=np.array(data['depletion_years'], dtype=np.int64))
+
+
+def run_streaming(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, workers=None, options=None):
+    """
+    Run simulations_to_run simulations keeping only summary statistics, memory
+    use does not grow with num_years or simulations_to_run.
+
+    Returns:
+        The run-wide accumulators, see new_summary() and fold_summary().
+    """
+    summary = new_summary(num_years, (options or {}).get('sampling', 'random'))
+    timer = (options or {}).get('timer')
+    for shard in iterate_summaries(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, workers, options):
+        start = time.perf_counter()
+        fold_summary(summary, shard)
+        if timer is not None:
+            timer.add('summary', time.perf_counter() - start, shard['final'].size)
+    return summary
+
+
+def run_to_precision(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, precision, confidence=0.95, workers=None,
+            options=None):
+    """
+    Run simulations as run_streaming() does until the confidence interval of
+    the success rate is narrow enough.
+
+    Args:
+        annual_spend,
+        inflation_rate,
+        savings_balance,
+        interest_rate,
+        num_years,
+        inflation_change,
+        interest_change:
+        Values as for run_simulation().
+        simulations_to_run: most simulations to run.
+        seed: master seed, each shard's seed is derived from it by shard_seed().
+        precision: largest half width of the confidence interval to stop at,
+            e.g. 0.005 for +/-0.5%.
+        confidence: confidence level of the interval, e.g. 0.95.
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options, see run_shards().
+    Returns:
+        The run-wide accumulators of the simulations run, see new_summary().
+    Explanation:
+        Shards are folded in shard order, and after each one the half width
+        of the interval is checked, see success_half_width(). Once it is at
+        most precision the shards the workers ran ahead are cancelled and
+        discarded, so where the run stops, and its result, are the same for
+        any number of workers. At least MIN_UNITS
+        independent units are run first, a lattice shard being one unit, so an
+        interval is never taken from a standard error with one or two degrees
+        of freedom, and the t quantile allows for the few there are. Shards
+        keep their position in the run, so the simulations are the first ones
+        of a full run with the same seed.
+    """
+    parameters = (annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change)
+    summary = new_summary(num_years, (options or {}).get('sampling', 'random'))
+    timer = (options or {}).get('timer')
+    results = run_shards(_summarize_shard, parameters, simulations_to_run, seed,
+            workers, options)
+    try:
+        for shard in results:
+            start = time.perf_counter()
+            fold_summary(summary, shard)
+            if timer is not None:
+                timer.add('summary', time.perf_counter() - start, shard['final'].size)
+            half_width = success_half_width(summary, confidence)
+            if half_width is not None and half_width <= precision:
+                break
+    finally:
+        results.close()
+    return summary
+
+
+def median_depletion_year(summary):
+    """Return the median year of depletion of the depleted simulations in a
+    summary, or None if no simulation was depleted."""
+    cumulative = np.cumsum(summary['depletion_years'][1:])
+    if cumulative[-1] == 0:
+        return None
+    return int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+
+
+def print_summary(summary):
+    """Write the success rate and final balance percentiles of a summary to
+    the console."""
+    simulations = summary['simulations']
+    successful_count = summary['successful']
+    percent = (successful_count/simulations)*100
+    print("\n----------------------------------------------")
+    print("Simulation was successful in " + str(successful_count) + "/" +
+        str(simulations) + " runs " + "(" + format(percent, '.2f') + "%)")
+    standard_error = success_standard_error(summary)
+    if standard_error is not None:
+        print("Standard error of the success rate: " +
+            format(standard_error * 100, '.2f') + "% (" +
+            summary.get('sampling', 'random') + " sampling)")
+    for name, q in (("P5", 0.05), ("P50", 0.50), ("P95", 0.95)):
+        # Every final balance may be NaN once spending overflows.
+        value = summary['final_balance'].quantile(q)
+        print("Final balance " + name + ": " +
+            ("n/a" if value is None else format(value, '.2f')))
+    non_finite = summary.get('non_finite', 0)
+    if non_finite:
+        print("Final balance overflowed (infinite or NaN) in " + str(non_finite) +
+            " runs")
+    print("Average balance: " + format(summary['mean_total']/simulations, '.2f'))
+    depleted = simulations - int(summary['depletion_years'][0])
+    if depleted:
+        print("Median year of depletion: " + str(median_depletion_year(summary)) +
+            " (" + str(depleted) + " runs depleted)")
+    print("----------------------------------------------")
+
+
+
+
+# =========================================================================== #
+#                               Output Writers                                #
+# =========================================================================== #
+
+def format_rows(balances):
+    """Format simulation results as lines of the text output file.
+
+    Args:
+        balances: array of shape (simulations, years).
+    Yields:
+        One line per simulation, each balance to two decimal places followed by
+        a space, then 'successful', or 'unsuccessful' if the final balance is
+        negative.
+    Explanation:
+        A single format string covers a whole row, so each line is built by
+        one formatting operation instead of one per value. Rows are converted
+        to Python floats a block at a time, a whole shard of long simulations
+        as floats would take several times the memory of its array.
+    """
+    row_format = "%.2f " * balances.shape[1] + "%s\n"
+    block = max(1, 65536 // balances.shape[1])
+    for start in range(0, len(balances), block):
+        rows = balances[start:start + block]
+        for row, successful in zip(rows.tolist(), is_successful(rows[:, -1]).tolist()):
+            if successful:
+                yield row_format % (*row, "successful")
+            else:
+                yield row_format % (*row, "unsuccessful")
+
+
+def write_text(f, balances, flush_size=FLUSH_SIZE, lengths=None):
+    """Append simulation results to an open text output file.
+
+    Args:
+        f: file opened in binary write or append mode.
+        balances: array of shape (simulations, years).
+        flush_size: number of bytes to buffer between writes to f.
+        lengths: optional list the length in bytes of each line is appended to.
+    Returns:
+        The number of bytes written.
+    """
+    bytes_written = 0
+    buffer = []
+    buffered = 0
+    for line in format_rows(balances):
+        buffer.append(line)
+        buffered += len(line)
+        if lengths is not None:
+            lengths.append(len(line))
+        if buffered >= flush_size:
+            f.write("".join(buffer).encode('ascii'))
+            bytes_written += buffered
+            buffer = []
+            buffered = 0
+    f.write("".join(buffer).encode('ascii'))
+    return bytes_written + buffered
+
+
+
+
+def new_binary_header(parameters, seed, dtype=np.float64, year_step=1):
+    """Return the header of a binary result file for a run.
+
+    Args:
+        parameters: tuple of the seven run_simulation() arguments.
+        seed: master seed of the run.
+        dtype: numpy type the balances are stored as, float64 or float32.
+        year_step: only every year_step'th year is stored, see kept_years().
+            'years' is then the number of years stored.
+    """
+    num_years = parameters[PARAMETER_NAMES.index('num_years')]
+    header = {'version': 1, 'dtype': np.dtype(dtype).str, 'simulations': 0,
+            'years': len(kept_years(num_years, year_step)),
+            'parameters': dict(zip(PARAMETER_NAMES, parameters)), 'seed': seed}
+    if year_step > 1:
+        header['year_step'] = year_step
+    return header
+
+
+def write_binary_header(f, header):
+    """Write header at the start of an open binary result file.
+
+    Raises:
+        ValueError: if the encoded header does not fit in BINARY_HEADER_SIZE.
+    """
+    encoded = json.dumps(header).encode('utf-8')
+    size = len(BINARY_MAGIC) + 4 + len(encoded)
+    if size > BINARY_HEADER_SIZE:
+        raise ValueError("Binary result header is too large.")
+    f.seek(0)
+    f.write(BINARY_MAGIC + len(encoded).to_bytes(4, 'little') + encoded +
+            bytes(BINARY_HEADER_SIZE - size))
+
+
+def write_binary(f, header, balances):
+    """Append simulation results to an open binary result file.
+
+    Args:
+        f: file opened in binary mode, positioned after the last row written.
+        header: header of the file, 'simulations' is updated.
+        balances: array of shape (simulations, years).
+    Returns:
+        The number of bytes written.
+    """
+    data = np.ascontiguousarray(balances, dtype=header['dtype'])
+    f.write(memoryview(data).cast('B'))
+    header['simulations'] += len(data)
+    return data.nbytes
+
+
+def finish_binary(f, header, successful):
+    """Append the success flags and write the final header of a binary
+    result file.
+
+    Args:
+        f: file opened in binary mode, positioned after the last row written.
+        header: header of the file.
+        successful: array of one boolean per simulation.
+    Returns:
+        The number of bytes written.
+    """
+    flags = np.asarray(successful, dtype=np.uint8)
+    f.write(flags.tobytes())
+    write_binary_header(f, header)
+    return flags.nbytes + BINARY_HEADER_SIZE
+
+
+def read_binary(filename):
+    """Open a binary result file without reading its balances into memory.
+
+    Args:
+        filename: path of a file written by write_binary().
+    Returns:
+        A tuple of the header, a read only (simulations, years) memory mapped
+        array of balances and an array of success flags.
+    Raises:
+        ValueError: if the file is not a binary result file.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("Not a binary result file.")
+        length = int.from_bytes(f.read(4), 'little')
+        header = json.loads(f.read(length).decode('utf-8'))
+    dtype = np.dtype(header['dtype'])
+    shape = (header['simulations'], header['years'])
+    if header['simulations'] == 0:
+        return header, np.empty(shape, dtype=dtype), np.empty(0, dtype=bool)
+    balances = np.memmap(filename, dtype=dtype, mode='r',
+            offset=BINARY_HEADER_SIZE, shape=shape)
+    successful = np.memmap(filename, dtype=np.uint8, mode='r',
+            offset=BINARY_HEADER_SIZE + balances.nbytes, shape=shape[:1])
+    return header, balances, successful.astype(bool)
+
+
+def write_results(filename, output_format, parameters, simulations_to_run,
+            seed, workers=None, options=None, flush_size=FLUSH_SIZE):
+    """
+    Run the simulations and write every balance to filename as each shard of
+    simulations arrives, while folding its statistics into a summary.
+
+    Args:
+        filename: path of the output file.
+        output_format: 'text' or 'binary'.
+        parameters: tuple of the seven run_simulation() arguments.
+        simulations_to_run: number of simulations to run.
+        seed: master seed of the run.
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options, see run_shards().
+        flush_size: number of bytes of text to buffer between writes, see
+            write_text().
+    Returns:
+        A tuple of the summary (see new_summary()), the number of bytes written
+        and the seconds spent writing.
+    Explanation:
+        Text: each value is formatted to two decimal places, followed by
+        'successful', or 'unsuccessful' if the last value was negative.
+        Binary: the balances are stored as they are, or as options 'dtype' and
+        'year_step' ask, see _compact_shard(), followed by a success flag for
+        each simulation.
+        A checkpoint is saved next to filename as the run progresses, see
+        resume_results(), and a summary index once it is finished, see
+        read_index().
+        The checkpoint and fan chart bands of a previous run to filename are
+        removed before it is overwritten, and the new run's first checkpoint
+        is saved before any simulation is written, so a run killed at any
+        moment is never resumed, or charted, from another run's files.
+    """
+    checkpoint = new_checkpoint(output_format, parameters, simulations_to_run,
+            seed, options)
+    for suffix in (CHECKPOINT_SUFFIX, BANDS_SUFFIX):
+        try:
+            os.remove(filename + suffix)
+        except FileNotFoundError:
+            pass
+    with open(filename, 'wb') as f, open(filename + INDEX_SUFFIX, 'wb') as index:
+        if output_format == "binary":
+            write_binary_header(f, new_binary_header(parameters, seed,
+                    checkpoint['dtype'], checkpoint['year_step']))
+        write_index_header(index, new_index_header(output_format, parameters,
+                dtype=checkpoint['dtype'], year_step=checkpoint['year_step']))
+        checkpoint['bytes'] = f.tell()
+        save_checkpoint(f, filename, checkpoint,
+                summary_from_dict(checkpoint['summary']), index)
+        return _append_results(f, filename, checkpoint, [], index, workers,
+                options, flush_size)
+
+
+def _append_results(f, filename, checkpoint, successful, index=None,
+            workers=None, options=None, flush_size=FLUSH_SIZE):
+    """
+    Run the simulations a checkpoint is missing and append them to its
+    output file.
+
+    Args:
+        f: output file, positioned at checkpoint['bytes'].
+        filename: path of the output file.
+        checkpoint: checkpoint of the run, see new_checkpoint(), updated as
+            shards are written.
+        successful: list of arrays of the success flags of the simulations
+            already in a binary output file.
+        index: optional summary index file, positioned after the record of the
+            last simulation already written, see read_index().
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options, see run_shards().
+        flush_size: number of bytes of text to buffer between writes, see
+            write_text().
+    Returns:
+        A tuple of the summary of every simulation in the file, the number of
+        bytes written and the seconds spent writing.
+    Explanation:
+        Compact balances, see _compact_shard(), arrive with the summary of the
+        full precision ones. How far the stored final balances are from them
+        is counted in the checkpoint, see print_precision().
+    """
+    output_format = checkpoint['format']
+    parameters = tuple(checkpoint['parameters'][name] for name in PARAMETER_NAMES)
+    seed = checkpoint['seed']
+    summary = summary_from_dict(checkpoint['summary'])
+    dtype = checkpoint.get('dtype', np.dtype(np.float64).str)
+    year_step = checkpoint.get('year_step', 1)
+    compact = np.dtype(dtype) != np.float64 or year_step > 1
+    header = new_binary_header(parameters, seed, dtype, year_step)
+    header['simulations'] = checkpoint['simulations']
+    if compact:
+        options = dict(options or {}, dtype=dtype, year_step=year_step)
+    results = run_shards(_compact_shard if compact else _run_shard, parameters,
+            checkpoint['simulations_to_run'] - checkpoint['simulations'], seed,
+            workers, options, first_shard=checkpoint['shards'])
+    timer = (options or {}).get('timer')
+    bytes_written = 0
+    write_time = 0
+    saved = time.perf_counter()
+    for balances in results:
+        start = time.perf_counter()
+        if compact:
+            shard, balances = balances
+            count_precision(checkpoint, shard, balances)
+        else:
+            shard = summarize_balances(balances)
+        fold_summary(summary, shard)
+        if timer is not None:
+            timer.add('summary', time.perf_counter() - start, len(balances))
+        start = time.perf_counter()
+        if output_format == "binary":
+            written = write_binary(f, header, balances)
+            successful.append(is_successful(shard['final']))
+            offsets = checkpoint['bytes'] + np.arange(len(balances)) * (
+                    written // len(balances))
+        else:
+            lengths = []
+            written = write_text(f, balances, flush_size, lengths)
+            offsets = checkpoint['bytes'] + np.cumsum([0] + lengths[:-1])
+        if index is not None:
+            written += write_index(index, shard, offsets)
+        bytes_written += written
+        write_time += time.perf_counter() - start
+        if timer is not None:
+            timer.add('write', time.perf_counter() - start, written, 'bytes')
+
+        checkpoint['simulations'] += len(balances)
+        checkpoint['shards'] += 1
+        checkpoint['bytes'] = f.tell()
+        if time.perf_counter() - saved >= CHECKPOINT_INTERVAL:
+            save_checkpoint(f, filename, checkpoint, summary, index)
+            saved = time.perf_counter()
+
+    if output_format == "binary":
+        start = time.perf_counter()
+        if successful:
+            successful = np.concatenate(successful)
+        written = finish_binary(f, header, successful)
+        bytes_written += written
+        write_time += time.perf_counter() - start
+        if timer is not None:
+            timer.add('write', time.perf_counter() - start, written, 'bytes')
+    if index is not None:
+        # The index is only valid once it records the size of the finished
+        # output file.
+        f.flush()
+        write_index_header(index, new_index_header(output_format, parameters,
+                checkpoint['simulations'], os.fstat(f.fileno()).st_size, dtype,
+                year_step))
+    checkpoint['finished'] = True
+    save_checkpoint(f, filename, checkpoint, summary, index)
+    return summary, bytes_written, write_time
+
+
+def print_write_speed(bytes_written, write_time):
+    """Write the amount and speed of output written to the console."""
+    megabytes = bytes_written / 1e6
+    print("Wrote " + format(megabytes, '.2f') + " MB in " + format(write_time, '.2f') +
+        "s (" + format(megabytes / max(write_time, 1e-9), '.2f') + " MB/s)")
+
+
+
+# =========================================================================== #
+#                                Memory Budget                                #
+# =========================================================================== #
+
+def kept_years(num_years, year_step=1):
+    """Return the years, counting from 0, a compact binary file stores: every
+    year_step'th year, and always the last, which decides success."""
+    years = np.arange(year_step - 1, num_years, year_step)
+    if years.size == 0 or years[-1] != num_years - 1:
+        years = np.append(years, num_years - 1)
+    return years
+
+
+def _compact_shard(job):
+    """
+    Run a shard and return its balances as a compact binary file stores them.
+
+    Args:
+        job: tuple of (parameters, seed, size, options) as for _run_shard().
+            options 'dtype' is the type the balances are stored as, and
+            'year_step' how often a year is kept, see kept_years().
+    Returns:
+        A tuple of the per-simulation accumulators of the full precision
+        balances, see summarize_balances(), and the compact balances.
+    Explanation:
+        The balances are always computed in float64, and the summary is taken
+        from them before they are reduced, so only the stored values lose
+        precision. Reducing them in the worker also shrinks the result sent to,
+        and queued in, the main process.
+    """
+    parameters, seed, size, options = job
+    balances = _run_shard(job)
+    years = kept_years(balances.shape[1], options.get('year_step', 1))
+    return summarize_balances(balances), np.ascontiguousarray(balances[:, years],
+            dtype=options.get('dtype', np.float64))
+
+
+def count_precision(checkpoint, shard, balances):
+    """
+    Count how far a shard's stored final balances are from full precision.
+
+    Args:
+        checkpoint: checkpoint of the run, see new_checkpoint(), its
+            'stored_successful' and 'stored_error' are updated.
+        shard: per-simulation accumulators of the full precision balances.
+        balances: the shard's balances as stored, see _compact_shard().
+    Explanation:
+        'stored_successful' counts the simulations whose stored final balance
+        is not negative, it differs from the summary's count where a float32
+        rounds a tiny negative balance to -0.0. 'stored_error' is the largest
+        error of a stored final balance, relative to the balance, or to 1 for
+        balances under 1, infinite if one overflowed float32.
+    """
+    stored = np.asarray(balances[:, -1], dtype=np.float64)
+    checkpoint['stored_successful'] = checkpoint.get('stored_successful', 0) + int(
+            np.count_nonzero(is_successful(stored)))
+    # Balances that already overflowed float64 carry no error of their own.
+    finite = np.isfinite(shard['final'])
+    error = np.abs(stored[finite] - shard['final'][finite]) / np.maximum(
+            np.abs(shard['final'][finite]), 1.0)
+    checkpoint['stored_error'] = max(checkpoint.get('stored_error', 0.0),
+            float(error.max(initial=0.0)))
+
+
+def print_precision(checkpoint):
+    """Write the success rate of a compact run's stored final balances, and
+    their largest error, to the console, see count_precision()."""
+    dtype = np.dtype(checkpoint.get('dtype', np.float64))
+    year_step = checkpoint.get('year_step', 1)
+    if dtype == np.float64 and year_step == 1:
+        return
+    simulations = checkpoint['simulations']
+    successful = checkpoint['summary']['successful']
+    stored = checkpoint.get('stored_successful', successful)
+    kept = "every year" if year_step == 1 else "every " + str(year_step) + " years"
+    print("Balances stored as " + dtype.name + ", " + kept + ", summary from "
+        "full precision balances")
+    print("Success rate of the stored final balances: " +
+        format(stored / simulations * 100, '.4f') + "% (" +
+        format((stored - successful) / simulations * 100, '+.4f') + "%, " +
+        str(abs(stored - successful)) + " runs differ)")
+    print("Largest relative error of a stored final balance: " +
+        format(checkpoint.get('stored_error', 0.0), '.2e'))
+
+
+def plan_memory(num_years, memory_limit, workers=None, output_format='text',
+            options=None, shard_size=None):
+    """
+    Choose the shard size and number of workers that fit a run in memory.
+
+    Args:
+        num_years: number of years in each simulation.
+        memory_limit: most bytes the run may use, across every process.
+        workers: most worker processes, defaults to the number of CPUs.
+        output_format: 'text', 'binary' or 'summary'.
+        options: optional dictionary of engine options, see run_shards().
+        shard_size: shard size the run must keep, e.g. one being resumed, then
+            only the number of workers is chosen.
+    Returns:
+        A tuple of the shard size and the number of workers.
+    Raises:
+        ValueError: if a single shard, or simulation, does not fit.
+    Explanation:
+        A worker holds about BALANCE_MEMORY bytes per balance of its shard
+        while it runs it, plus the result it sends back. The main process
+        queues up to two results per worker (see map_shards()) and receives
+        one more, and every process takes PROCESS_MEMORY. Summaries of random
+        walks are stepped a year at a time and hold no balances, see
+        _summarize_shard().
+        The shard size is the largest, up to SHARD_SIZE, a single process fits,
+        so it only depends on num_years and memory_limit and a seed gives the
+        same results on any machine. Shards smaller than SHARD_SIZE change the
+        random streams, so those results differ from a run without a limit.
+        Workers are then added while they fit.
+    """
+    options = options or {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if output_format == "summary":
+        # Each shard returns five values per simulation.
+        result = 40
+        working = num_years * BALANCE_MEMORY + result
+        if (options.get('history') is None and
+                options.get('sampling', 'random') == 'random'):
+            working = 128
+    else:
+        result = len(kept_years(num_years, options.get('year_step', 1))) * (
+                np.dtype(options.get('dtype', np.float64)).itemsize)
+        working = num_years * BALANCE_MEMORY + result
+
+    def needed(size, count):
+        # A single worker runs its shards in the main process.
+        if count == 1:
+            return PROCESS_MEMORY + size * working
+        return (count + 1) * PROCESS_MEMORY + size * (count * working +
+                (2 * count + 1) * result)
+
+    if shard_size is None:
+        shard_size = min(SHARD_SIZE, (memory_limit - PROCESS_MEMORY) // working)
+        if shard_size < 1:
+            raise ValueError(format(memory_limit / 1024 / 1024, '.0f') + " MB is "
+                    "too little memory for a simulation of " + str(num_years) +
+                    " years.")
+    elif needed(shard_size, 1) > memory_limit:
+        raise ValueError(format(memory_limit / 1024 / 1024, '.0f') + " MB is "
+                "too little memory for a shard of " + str(shard_size) +
+                " simulations of " + str(num_years) + " years.")
+    count = 1
+    while count < workers and needed(shard_size, count + 1) <= memory_limit:
+        count += 1
+    return int(shard_size), count
+
+
+
+# =========================================================================== #
+#                                 Checkpoints                                 #
+# =========================================================================== #
+
+def run_identity(parameters, seed, options=None):
+    """Return the hash of everything a run's balances depend on, other than
+    the number of simulations, see ResultCache.key()."""
+    return ResultCache.key(parameters, None, seed, options)
+
+
+def new_checkpoint(output_format, parameters, simulations_to_run, seed,
+            options=None):
+    """
+    Return the checkpoint of a run that has not written any simulations.
+
+    Explanation:
+        'simulations' counts the simulations written, in 'shards' shards,
+        ending 'bytes' into the output file. 'simulations_to_run' is the total
+        the run is to reach. 'identity' is checked when the run is resumed, so
+        it cannot be continued with different engine options.
+        'stored_successful' and 'stored_error' count how far the stored final
+        balances are from full precision, see count_precision().
+    """
+    options = options or {}
+    return {'version': 1, 'format': output_format,
+            'parameters': dict(zip(PARAMETER_NAMES, parameters)), 'seed': seed,
+            'stop_on_ruin': bool(options.get('stop_on_ruin')),
+            'sampling': options.get('sampling', 'random'),
+            'shard_size': options.get('shard_size', SHARD_SIZE),
+            'dtype': np.dtype(options.get('dtype', np.float64)).str,
+            'year_step': options.get('year_step', 1),
+            'stored_successful': 0, 'stored_error': 0.0,
+            'identity': run_identity(parameters, seed, options),
+            'simulations_to_run': simulations_to_run, 'simulations': 0,
+            'shards': 0, 'bytes': 0, 'finished': False,
+            'summary': summary_to_dict(new_summary(
+                parameters[PARAMETER_NAMES.index('num_years')],
+                options.get('sampling', 'random')))}
+
+
+def save_checkpoint(f, filename, checkpoint, summary, index=None):
+    """
+    Flush the output file to disk, then save its checkpoint next to it.
+
+    Args:
+        f: open output file.
+        filename: path of the output file.
+        checkpoint: checkpoint of the run, see new_checkpoint().
+        summary: summary of every simulation written so far.
+        index: optional open summary index file, flushed with the output.
+    Explanation:
+        The output is on disk before the checkpoint that counts it, and the
+        checkpoint replaces the previous one in a single rename, so a run
+        killed at any moment still has a checkpoint matching its output.
+    """
+    for output in (f, index):
+        if output is not None:
+            output.flush()
+            os.fsync(output.fileno())
+    checkpoint['summary'] = summary_to_dict(summary)
+    temporary = filename + CHECKPOINT_SUFFIX + '.partial'
+    with open(temporary, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary, filename + CHECKPOINT_SUFFIX)
+
+
+def read_checkpoint(filename):
+    """Return the checkpoint saved next to an output file.
+
+    Raises:
+        ValueError: if filename has no readable checkpoint.
+    """
+    try:
+        with open(filename + CHECKPOINT_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise ValueError(filename + " has no checkpoint to resume from.")
+
+
+def resume_results(filename, simulations_to_add=0, workers=None, options=None,
+            flush_size=FLUSH_SIZE):
+    """
+    Finish an interrupted run and/or add more simulations to a finished one.
+
+    Args:
+        filename: path of a text or binary output file with a checkpoint.
+        simulations_to_add: number of simulations to add beyond the run's
+            original simulations_to_run.
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: dictionary of engine options the run was started with, see
+            run_shards().
+        flush_size: number of bytes of text to buffer between writes, see
+            write_text().
+    Returns:
+        A tuple of the summary of every simulation in the file, the number of
+        bytes written and the seconds spent writing, as for write_results().
+    Raises:
+        ValueError: if filename has no checkpoint, was run with different
+            engine options or engine version, or is shorter than its
+            checkpoint, as it is once overwritten by another run.
+    Explanation:
+        Anything written after the last checkpoint is cut off, then the missing
+        shards are run and appended, continuing from the next shard's stream.
+        The summary is updated from the one saved in the checkpoint, existing
+        simulations are neither recomputed nor reread, except for the success
+        flags of a binary file, which are moved to after the new balances.
+        The summary index is extended the same way, or removed if it does not
+        hold a record for every simulation already written. The fan chart
+        bands are removed, they no longer match the file.
+    """
+    checkpoint = read_checkpoint(filename)
+    parameters = tuple(checkpoint['parameters'][name] for name in PARAMETER_NAMES)
+    if checkpoint['identity'] != run_identity(parameters, checkpoint['seed'], options):
+        raise ValueError(filename + " was run with different engine options "
+                "or an older version of fi.py.")
+    finished = checkpoint['finished']
+    checkpoint['simulations_to_run'] += simulations_to_add
+    checkpoint['finished'] = False
+    successful = []
+    with open(filename, 'r+b') as f:
+        if os.fstat(f.fileno()).st_size < checkpoint['bytes']:
+            raise ValueError(filename + " is shorter than its checkpoint, it was "
+                    "overwritten or damaged since.")
+        try:
+            os.remove(filename + BANDS_SUFFIX)
+        except FileNotFoundError:
+            pass
+        if checkpoint['format'] == "binary" and checkpoint['simulations']:
+            flags = np.empty(0)
+            if finished:
+                # A finished file's flags follow its balances.
+                f.seek(checkpoint['bytes'])
+                flags = np.frombuffer(f.read(checkpoint['simulations']), dtype=np.uint8)
+            if flags.size != checkpoint['simulations']:
+                # Interrupted before the flags were written, recompute them
+                # from each simulation's final balance.
+                balances = np.memmap(filename, dtype=checkpoint.get('dtype',
+                        np.float64), mode='r', offset=BINARY_HEADER_SIZE,
+                        shape=(checkpoint['simulations'], len(kept_years(
+                        checkpoint['parameters']['num_years'],
+                        checkpoint.get('year_step', 1)))))
+                flags = is_successful(balances[:, -1])
+                del balances
+            successful.append(np.asarray(flags, dtype=bool))
+        f.truncate(checkpoint['bytes'])
+        f.seek(checkpoint['bytes'])
+        index_bytes = INDEX_HEADER_SIZE + checkpoint['simulations'] * INDEX_DTYPE.itemsize
+        try:
+            index = open(filename + INDEX_SUFFIX, 'r+b')
+        except OSError:
+            index = None
+        if index is not None and os.fstat(index.fileno()).st_size < index_bytes:
+            index.close()
+            os.remove(filename + INDEX_SUFFIX)
+            index = None
+        if index is None:
+            return _append_results(f, filename, checkpoint, successful, None,
+                    workers, options, flush_size)
+        with index:
+            # Unfinished until _append_results() writes the final header.
+            write_index_header(index, new_index_header(checkpoint['format'],
+                    parameters))
+            index.truncate(index_bytes)
+            index.seek(index_bytes)
+            return _append_results(f, filename, checkpoint, successful, index,
+                    workers, options, flush_size)
+
+
+
+
+# =========================================================================== #
+#                                Summary Index                                #
+# =========================================================================== #
+
+def new_index_header(output_format, parameters, simulations=0, size=0,
+            dtype=np.float64, year_step=1):
+    """Return the header of the summary index of an output file.
+
+    Args:
+        output_format: 'text' or 'binary', the format of the output file.
+        parameters: tuple of the seven run_simulation() arguments.
+        simulations: number of records in the index.
+        size: size in bytes of the finished output file, 0 while it is being
+            written, so an unfinished index is never used.
+        dtype, year_step: type and years the balances are stored in, as for
+            new_binary_header(). The records always hold full precision
+            values.
+    """
+    return {'version': 1, 'format': output_format, 'simulations': simulations,
+            'years': len(kept_years(parameters[PARAMETER_NAMES.index('num_years')],
+            year_step)), 'dtype': np.dtype(dtype).str, 'size': size}
+
+
+def write_index_header(f, header):
+    """Write header at the start of an open summary index file, leaving f
+    positioned where it was.
+
+    Raises:
+        ValueError: if the encoded header does not fit in INDEX_HEADER_SIZE.
+    """
+    encoded = json.dumps(header).encode('utf-8')
+    size = len(INDEX_MAGIC) + 4 + len(encoded)
+    if size > INDEX_HEADER_SIZE:
+        raise ValueError("Summary index header is too large.")
+    position = f.tell()
+    f.seek(0)
+    f.write(INDEX_MAGIC + len(encoded).to_bytes(4, 'little') + encoded +
+            bytes(INDEX_HEADER_SIZE - size))
+    f.seek(max(position, INDEX_HEADER_SIZE))
+
+
+def write_index(f, shard, offsets):
+    """Append the records of a shard's simulations to an open summary index.
+
+    Args:
+        f: summary index file, positioned after the last record written.
+        shard: per-simulation accumulators, see summarize_balances().
+        offsets: byte offset of each simulation's balances in the output file.
+    Returns:
+        The number of bytes written.
+    """
+    records = np.empty(len(offsets), dtype=INDEX_DTYPE)
+    records['offset'] = offsets
+    records['maximum'] = shard['maximum']
+    records['minimum'] = shard['minimum']
+    records['mean'] = shard['mean']
+    records['final'] = shard['final']
+    records['successful'] = is_successful(shard['final'])
+    f.write(records.tobytes())
+    return records.nbytes
+
+
+def read_index(filename):
+    """
+    Open the summary index written next to an output file.
+
+    Args:
+        filename: path of a text or binary output file.
+    Returns:
+        A tuple of the index header, see new_index_header(), and a read only
+        memory mapped array of INDEX_DTYPE records, one per simulation in file
+        order. None if filename has no index, or its index is unfinished or
+        does not match the file's size.
+    """
+    try:
+        with open(filename + INDEX_SUFFIX, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            length = int.from_bytes(f.read(4), 'little')
+            header = json.loads(f.read(length).decode('utf-8'))
+        expected = INDEX_HEADER_SIZE + header['simulations'] * INDEX_DTYPE.itemsize
+        if (header['size'] != os.path.getsize(filename) or
+                os.path.getsize(filename + INDEX_SUFFIX) != expected):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    if header['simulations'] == 0:
+        return header, np.empty(0, dtype=INDEX_DTYPE)
+    records = np.memmap(filename + INDEX_SUFFIX, dtype=INDEX_DTYPE, mode='r',
+            offset=INDEX_HEADER_SIZE, shape=(header['simulations'],))
+    return header, records
+
+
+def read_simulation(filename, header, records, index):
+    """Read the balances of a single simulation from an indexed output file.
+
+    Args:
+        filename: path of the output file.
+        header, records: index of the file, as returned by read_index().
+        index: position of the simulation in the file.
+    Returns:
+        An array of the simulation's balance in each year.
+    Raises:
+        ValueError: if the simulation's line in a text file is invalid.
+    """
+    offset = int(records['offset'][index])
+    if header['format'] == "binary":
+        return np.fromfile(filename, dtype=header['dtype'], count=header['years'],
+                offset=offset)
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        values = f.readline().decode('ascii').split(' ')
+    # The last value is 'successful' or 'unsuccessful'.
+    return np.array(values[:-1], dtype=np.float64)
+
+
+def write_bands(filename, years, bands):
+    """
+    Save the fan chart bands of an output file next to it.
+
+    Args:
+        filename: path of the output file.
+        years: array of the years, counting from 0, the bands are for.
+        bands: array of shape (len(BAND_QUANTILES), len(years)), see
+            YearlyQuantileSketch.quantiles().
+    """
+    temporary = filename + BANDS_SUFFIX + '.partial'
+    with open(temporary, 'wb') as f:
+        np.savez(f, years=years, bands=bands, quantiles=BAND_QUANTILES,
+                identity=band_identity(filename))
+    os.replace(temporary, filename + BANDS_SUFFIX)
+
+
+def read_bands(filename):
+    """Return the (years, bands) saved by write_bands() next to an output file,
+    or None if there are none, or they were computed from another run."""
+    try:
+        with np.load(filename + BANDS_SUFFIX) as data:
+            if (str(data['identity']) != band_identity(filename) or
+                    tuple(data['quantiles'].tolist()) != BAND_QUANTILES):
+                return None
+            return data['years'], data['bands']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def band_identity(filename):
+    """
+    Return the text identifying the contents of an output file that its fan
+    chart bands are checked against.
+
+    Explanation:
+        The size alone does not tell runs apart, every binary file of the same
+        number of simulations and years has the same size. The identity of
+        the run (parameters, seed and engine options) and the number of
+        simulations come from the file's checkpoint, and the seed and
+        parameters also from a binary file's header, so files written before
+        checkpoints existed are still told apart. The modification time
+        catches files changed by other programs.
+    """
+    status = os.stat(filename)
+    identity = {'size': status.st_size, 'modified': status.st_mtime_ns}
+    try:
+        checkpoint = read_checkpoint(filename)
+        identity['run'] = checkpoint['identity']
+        identity['simulations'] = checkpoint['simulations']
+    except (ValueError, KeyError):
+        pass
+    with open(filename, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+            length = int.from_bytes(f.read(4), 'little')
+            header = json.loads(f.read(length).decode('utf-8'))
+            identity['seed'] = header.get('seed')
+            identity['parameters'] = header.get('parameters')
+    return json.dumps(identity, sort_keys=True)
+
+
+
+
+# =========================================================================== #
+#                                Result Cache                                 #
+# =========================================================================== #
+
+class ResultCache:
+    """
+    On disk cache of the summaries, and output files, of previous runs.
+
+    Explanation:
+        Each run is stored in a directory named by the hash of everything its
+        results depend on, see key(). The directory holds 'summary.json' and,
+        for text or binary runs, the output file with its checkpoint and
+        summary index. Its summary's modification
+        time records when it was last used, and the least recently used runs
+        are removed once the cache holds more than max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(parameters, simulations_to_run, seed, options=None):
+        """Return the hash identifying the results of a run.
+
+        Args:
+            parameters: tuple of the seven run_simulation() arguments.
+            simulations_to_run: number of simulations.
+            seed: master seed of the run.
+            options: optional dictionary of engine options, see run_shards().
+        """
+        options = options or {}
+        identity = {'engine': ENGINE_VERSION, 'parameters': list(parameters),
+                'simulations': simulations_to_run, 'seed': seed,
+                'stop_on_ruin': bool(options.get('stop_on_ruin'))}
+        if options.get('history') is not None:
+            rates, blocks = options['history']
+            identity['history'] = hashlib.sha256(rates.tobytes()).hexdigest()
+            identity['block_size'] = blocks.shape[1]
+        # Runs from before sampling schemes and memory limits keep their keys.
+        if options.get('sampling', 'random') != 'random':
+            identity['sampling'] = options['sampling']
+        if options.get('shard_size', SHARD_SIZE) != SHARD_SIZE:
+            identity['shard_size'] = options['shard_size']
+        if np.dtype(options.get('dtype', np.float64)) != np.float64:
+            identity['dtype'] = np.dtype(options['dtype']).str
+        if options.get('year_step', 1) > 1:
+            identity['year_step'] = options['year_step']
+        encoded = json.dumps(identity, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def load(self, key, output_format='summary', filename=None):
+        """
+        Look up a run.
+
+        Args:
+            key: hash of the run, see key().
+            output_format: 'summary', or 'text' or 'binary' to also copy the
+                cached output file to filename.
+            filename: path to copy the cached output file to.
+        Returns:
+            The summary of the run, see new_summary(), or None if it is not
+            cached.
+        """
+        entry = os.path.join(self.directory, key)
+        summary_file = os.path.join(entry, 'summary.json')
+        try:
+            if output_format != "summary":
+                shutil.copyfile(os.path.join(entry, output_format), filename)
+            with open(summary_file) as f:
+                data = json.load(f)
+            os.utime(summary_file)
+            # The output's checkpoint lets a served run be topped up, and its
+            # index lets figui.py open it without rescanning. Those of a
+            # previous run to filename no longer match it.
+            for suffix in (CHECKPOINT_SUFFIX, INDEX_SUFFIX):
+                if output_format == "summary":
+                    break
+                if os.path.exists(os.path.join(entry, output_format + suffix)):
+                    shutil.copyfile(os.path.join(entry, output_format + suffix),
+                            filename + suffix)
+                elif os.path.exists(filename + suffix):
+                    os.remove(filename + suffix)
+        except (OSError, ValueError):
+            return None
+        return summary_from_dict(data)
+
+    def store(self, key, summary, output_format='summary', filename=None):
+        """
+        Add a run, then remove the least recently used runs over max_bytes.
+
+        Args:
+            key: hash of the run, see key().
+            summary: summary of the run, see new_summary().
+            output_format: 'summary', or 'text' or 'binary' to also store the
+                output file at filename. Output files larger than max_bytes
+                are not stored.
+            filename: path of the output file.
+        """
+        data = summary_to_dict(summary)
+        entry = os.path.join(self.directory, key)
+        # Each file is written under a temporary name unique to this call and
+        # then renamed, so a reader never sees half a file, even while other
+        # threads or processes store the same run. Output files of other
+        # formats already cached for the run are kept.
+        temporary = None
+        try:
+            os.makedirs(entry, exist_ok=True)
+            files = []
+            if output_format != "summary" and os.path.getsize(filename) <= self.max_bytes:
+                files.append((filename, output_format))
+                for suffix in (CHECKPOINT_SUFFIX, INDEX_SUFFIX):
+                    if os.path.exists(filename + suffix):
+                        files.append((filename + suffix, output_format + suffix))
+            files.append((None, 'summary.json'))
+            for source, name in files:
+                descriptor, temporary = tempfile.mkstemp(prefix='partial.', dir=entry)
+                with os.fdopen(descriptor, 'w') as f:
+                    if source is None:
+                        json.dump(data, f)
+                if source is not None:
+                    shutil.copyfile(source, temporary)
+                os.replace(temporary, os.path.join(entry, name))
+                temporary = None
+        except OSError:
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used runs until at most max_bytes are
+        cached."""
+        entries = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            try:
+                used = os.path.getmtime(os.path.join(entry, 'summary.json'))
+                size = sum(os.path.getsize(os.path.join(entry, file))
+                        for file in os.listdir(entry))
+            except OSError:
+                continue
+            entries.append((used, size, entry))
+        total = sum(size for used, size, entry in entries)
+        for used, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def run_cached(cache, filename, output_format, parameters, simulations_to_run,
+            seed, workers=None, options=None, flush_size=FLUSH_SIZE):
+    """
+    Run the simulations with write_results(), or run_streaming() for the
+    'summary' format, unless the run is found in cache.
+
+    Args:
+        cache: ResultCache, or None to always run the simulations.
+        filename: path of the output file, not used for 'summary'.
+        output_format: 'text', 'binary' or 'summary'.
+        parameters, simulations_to_run, seed, workers, options, flush_size:
+        As for write_results().
+    Returns:
+        A tuple of the summary, the number of bytes written, the seconds spent
+        writing and whether the run was found in cache.
+    """
+    key = None
+    if cache is not None:
+        key = cache.key(parameters, simulations_to_run, seed, options)
+        summary = cache.load(key, output_format, filename)
+        if summary is not None:
+            return summary, 0, 0, True
+
+    if output_format == "summary":
+        summary = run_streaming(*parameters, simulations_to_run, seed, workers,
+                options)
+        bytes_written, write_time = 0, 0
+    else:
+        summary, bytes_written, write_time = write_results(filename,
+                output_format, parameters, simulations_to_run, seed, workers,
+                options, flush_size)
+    if cache is not None:
+        cache.store(key, summary, output_format, filename)
+    return summary, bytes_written, write_time, False
+
+
+
+
+# =========================================================================== #
+#                              Parameter Sweeps                               #
+# =========================================================================== #
+
+def _sweep_shard(job):
+    """
+    Count the successful simulations of a shard at every point of a grid.
+
+    Args:
+        job: tuple of (grid, seed, size, options), grid is a tuple with a list
+            of values for each of PARAMETER_NAMES.
+    Returns:
+        An array of success counts with one axis per parameter.
+    Explanation:
+        One set of shocks is drawn for the longest num_years and reused at every
+        grid point (common random numbers).
+        For fixed rate paths the balance is affine in savings_balance and
+        annual_spend: balance = savings_balance * G - annual_spend * H, where
+            G[n] = G[n-1] * (1 + interest[n])
+            H[n] = (H[n-1] + spend growth[n]) * (1 + interest[n])
+        so G and H are stepped once per combination of the four rate
+        parameters, and every (annual_spend, savings_balance) pair is then a
+        single broadcast multiply.
+    """
+    grid, seed, size, options = job
+    (annual_spends, inflation_rates, savings_balances, interest_rates,
+            num_years, inflation_changes, interest_changes) = grid
+    spends = np.asarray(annual_spends, dtype=np.float64)[:, None, None]
+    balances = np.asarray(savings_balances, dtype=np.float64)[None, :, None]
+    rng = np.random.default_rng(seed)
+
+    # Sum of the first n shocks of each rate, the rate used in year n is the
+    # base rate plus the change times this sum, as in run_simulations().
+    shocks = draw_shocks(rng, max(num_years), size,
+            options.get('sampling', 'random'))
+    shock_sums = np.zeros_like(shocks)
+    np.cumsum(shocks[:-1], axis=0, out=shock_sums[1:])
+
+    counts = np.zeros([len(values) for values in grid], dtype=np.int64)
+    for (i, inflation_rate), (j, inflation_change) in itertools.product(
+            enumerate(inflation_rates), enumerate(inflation_changes)):
+        growth = np.cumprod(1 + inflation_rate + inflation_change * shock_sums[:, 0], axis=0)
+        for (k, interest_rate), (m, interest_change) in itertools.product(
+                enumerate(interest_rates), enumerate(interest_changes)):
+            interest = 1 + interest_rate + interest_change * shock_sums[:, 1]
+            factor = np.ones(size)
+            spent = np.zeros(size)
+            for year in range(max(num_years)):
+                factor *= interest[year]
+                spent += growth[year]
+                spent *= interest[year]
+                for n, years in enumerate(num_years):
+                    if years == year + 1:
+                        final = balances * factor - spends * spent
+                        counts[:, i, :, k, n, j, m] = np.count_nonzero(is_successful(final), axis=-1)
+    return counts
+
+
+def run_sweep(grid, simulations_to_run, seed, workers=None, options=None):
+    """
+    Estimate the probability of success at every point of a parameter grid.
+
+    Args:
+        grid: dictionary with a value, or a list of values, for each of
+            PARAMETER_NAMES.
+        simulations_to_run: number of simulations at each grid point.
+        seed: master seed, the same shocks are used at every grid point.
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options, only 'sampling' is
+            used, see run_shards().
+    Returns:
+        A tuple of the grid, as a tuple of value lists in PARAMETER_NAMES order,
+        and an array of success probabilities with one axis per parameter.
+    """
+    grid = tuple(list(np.atleast_1d(grid[name]).tolist()) for name in PARAMETER_NAMES)
+    counts = sum(run_shards(_sweep_shard, grid, simulations_to_run, seed, workers,
+            options))
+    return grid, counts / simulations_to_run
+
+
+def parse_sweep(text):
+    """argparse type for a sweep, 'name=start:stop:step' or 'name=a,b,c'.
+
+    Returns:
+        A tuple of the parameter name and its list of values.
+    """
+    name, _, values = text.partition('=')
+    name = name.strip().replace('-', '_')
+    if name not in PARAMETER_NAMES:
+        raise argparse.ArgumentTypeError("unknown parameter '" + name + "'")
+    if name in INTEGER_PARAMETERS:
+        number = int
+    else:
+        number = float
+    try:
+        if ':' in values:
+            start, stop, step = (number(value) for value in values.split(':'))
+            count = int(math.floor((stop - start) / step + 1e-9)) + 1
+            values = [number(start + step * i) for i in range(count)]
+        else:
+            values = [number(value) for value in values.split(',')]
+    except (ValueError, ZeroDivisionError):
+        raise argparse.ArgumentTypeError("invalid values for '" + name + "'")
+    if not values or (name == 'num_years' and min(values) <= 0):
+        raise argparse.ArgumentTypeError("invalid values for '" + name + "'")
+    return name, values
+
+
+def write_sweep(f, grid, success):
+    """Write a sweep as CSV, one row per grid point, with a column for each
+    parameter that was swept and the probability of success."""
+    swept = [i for i, values in enumerate(grid) if len(values) > 1]
+    writer = csv.writer(f)
+    writer.writerow([PARAMETER_NAMES[i] for i in swept] + ['success_rate'])
+    for point in itertools.product(*(range(len(values)) for values in grid)):
+        writer.writerow([grid[i][point[i]] for i in swept] +
+                [format(success[point], '.4f')])
+
+
+
+# =========================================================================== #
+#                               Cohort Batches                                #
+# =========================================================================== #
+
+def _cohort_shard(job):
+    """
+    Simulate a shard of paths for every client of a chunk at once.
+
+    Args:
+        job: tuple of (clients, seed, size, options), clients is a tuple of an
+            array for each of PARAMETER_NAMES, one element per client.
+    Returns:
+        A tuple of two (clients, size) arrays: each path's final balance, in
+        the client's own num_years, and the year it was first depleted
+        (counting from 1), or -1.
+    Explanation:
+        One set of shocks is drawn for the longest num_years and shared by
+        every client (common random numbers), so a client's paths are the same
+        as those of a run of its own with the same seed, except with qmc
+        sampling, whose lattice depends on the number of years. Each year's rates
+        are the base rate plus the change times the sum of the earlier shocks,
+        as in _sweep_shard(), computed for the whole (clients, paths) array
+        without storing any per-year array.
+    """
+    clients, seed, size, options = job
+    (annual_spends, inflation_rates, savings_balances, interest_rates,
+            num_years, inflation_changes, interest_changes) = (
+            np.asarray(values)[:, None] for values in clients)
+    years = int(num_years.max())
+    stop_on_ruin = options.get('stop_on_ruin', False)
+    rng = np.random.default_rng(seed)
+    history = options.get('history')
+    if history is not None:
+        rates = bootstrap_rates(rng, history, years, size)
+    else:
+        shocks = draw_shocks(rng, years, size, options.get('sampling', 'random'))
+        shock_sums = np.zeros_like(shocks)
+        np.cumsum(shocks[:-1], axis=0, out=shock_sums[1:])
+
+    shape = (len(annual_spends), size)
+    growth = np.ones(shape)
+    balance = np.empty(shape)
+    balance[:] = savings_balances
+    final = np.empty(shape)
+    depletion_year = np.full(shape, -1, dtype=np.int32)
+    if stop_on_ruin:
+        ruined = np.empty(shape)
+    for year in range(years):
+        if history is not None:
+            inflation, interest = rates[year]
+        else:
+            inflation = inflation_rates + inflation_changes * shock_sums[year, 0]
+            interest = interest_rates + interest_changes * shock_sums[year, 1]
+        growth *= 1 + inflation
+        balance -= annual_spends * growth
+        balance += balance * interest
+        depleted = (balance < 0) & (depletion_year < 0) & (year < num_years)
+        if depleted.any():
+            depletion_year[depleted] = year + 1
+            if stop_on_ruin:
+                ruined[depleted] = balance[depleted]
+        ending = num_years[:, 0] == year + 1
+        if ending.any():
+            final[ending] = balance[ending]
+    # A depleted path keeps its first negative balance, as in run_simulations().
+    if stop_on_ruin:
+        final = np.where(depletion_year > 0, ruined, final)
+    return final, depletion_year
+
+
+def run_cohort(clients, simulations_to_run, seed, workers=None, options=None,
+            chunk_size=None):
+    """
+    Simulate every client of a cohort and summarize each one's paths.
+
+    Args:
+        clients: tuple of an array for each of PARAMETER_NAMES, one element
+            per client, see load_cohort().
+        simulations_to_run: number of paths simulated for each client.
+        seed: master seed, the same shocks are used for every client.
+        workers: number of worker processes, defaults to the number of CPUs.
+        options: optional dictionary of engine options, see run_shards().
+        chunk_size: number of clients summarized together, defaults to as
+            many as fit in COHORT_MEMORY.
+    Returns:
+        A dictionary of arrays with one element per client: 'success_rate',
+        'median_final' and 'p10_final' balance, and 'median_depletion_year' of
+        the depleted paths, 0 if none were depleted.
+    Explanation:
+        Clients are summarized a chunk at a time. A chunk is split into blocks
+        of clients and its paths into shards, and each (block, shard) pair is
+        a job for the worker processes, so a cohort runs in parallel even with
+        a single shard of paths. Blocks are as large as fit in
+        COHORT_WORKER_MEMORY next to the shard's shocks, and small enough to
+        give every worker a job. Only the final balance and year of depletion
+        of each of a chunk's paths are kept, so the percentiles are exact and
+        memory is bounded by chunk_size, not the cohort's size. A single pool
+        of workers serves every chunk.
+    """
+    options = dict(options or {})
+    count = len(clients[0])
+    if chunk_size is None:
+        chunk_size = max(1, COHORT_MEMORY // (COHORT_PATH_MEMORY * simulations_to_run))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    sizes = shard_sizes(simulations_to_run)
+    shocks = COHORT_SHOCK_MEMORY * int(np.max(clients[PARAMETER_NAMES.index(
+            'num_years')])) * sizes[0]
+    block_size = max(1, (COHORT_WORKER_MEMORY - shocks) // (COHORT_WORKER_PATH_MEMORY *
+            sizes[0]))
+    block_size = min(block_size, -(-min(chunk_size, count) // -(-workers // len(sizes))))
+    results = {name: np.zeros(count) for name in ('success_rate', 'median_final',
+            'p10_final', 'median_depletion_year')}
+    executor = options.pop('executor', None)
+    options.pop('timer', None)
+    pool = None
+    if workers > 1 and executor is None:
+        pool = executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for start in range(0, count, chunk_size):
+            chunk = tuple(np.asarray(values[start:start + chunk_size])
+                    for values in clients)
+            blocks = range(0, len(chunk[0]), block_size)
+            jobs = [(tuple(values[block:block + block_size] for values in chunk),
+                    shard_seed(seed, index), size, options)
+                    for block in blocks for index, size in enumerate(sizes)]
+            final = np.empty((len(chunk[0]), simulations_to_run))
+            depletion_year = np.empty(final.shape, dtype=np.int32)
+            # Jobs are in block order, then shard order.
+            paths = np.cumsum([0] + sizes)
+            for number, shard in enumerate(map_shards(_cohort_shard, jobs,
+                    workers, executor)):
+                block = blocks[number // len(sizes)]
+                index = number % len(sizes)
+                rows = slice(block, block + len(shard[0]))
+                final[rows, paths[index]:paths[index + 1]] = shard[0]
+                depletion_year[rows, paths[index]:paths[index + 1]] = shard[1]
+            rows = slice(start, start + len(chunk[0]))
+            results['success_rate'][rows] = np.count_nonzero(is_successful(final),
+                    axis=1) / simulations_to_run
+            results['p10_final'][rows], results['median_final'][rows] = np.quantile(
+                    final, (0.10, 0.50), axis=1)
+            # Lower median of the depleted paths, as median_depletion_year().
+            depleted = np.count_nonzero(depletion_year > 0, axis=1)
+            depletion_year[depletion_year < 0] = np.iinfo(np.int32).max
+            depletion_year.sort(axis=1)
+            median = depletion_year[np.arange(len(depleted)),
+                    np.maximum(depleted - 1, 0) // 2]
+            results['median_depletion_year'][rows] = np.where(depleted > 0, median, 0)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
+
+def load_cohort(filename, defaults=None):
+    """
+    Read the client profiles of a cohort from a CSV file.
+
+    Args:
+        filename: path of a CSV file with a header row and one row per client.
+            Columns are named after PARAMETER_NAMES (case and '-' or '_' do not
+            matter), an optional 'client' (or 'id') column names each client.
+            Other columns are ignored.
+        defaults: optional dictionary of values for parameters with no column.
+    Returns:
+        A tuple of the list of client names, row numbers if there is no
+        'client' column, and a tuple of an array for each of PARAMETER_NAMES.
+    Raises:
+        ValueError: if a parameter has neither a column nor a default, or a
+            value is invalid.
+    """
+    defaults = defaults or {}
+    with open(filename, newline='') as f:
+        reader = csv.DictReader(f)
+        columns = {name.strip().lower().replace('-', '_'): name
+                for name in reader.fieldnames or []}
+        missing = [name for name in PARAMETER_NAMES
+                if name not in columns and defaults.get(name) is None]
+        if missing:
+            raise ValueError(filename + " has no column for " + ", ".join(missing) +
+                    " and no value on the command line.")
+        names = []
+        values = [[] for name in PARAMETER_NAMES]
+        for number, row in enumerate(reader, 1):
+            names.append(row.get(columns.get('client', columns.get('id')), str(number)))
+            for i, name in enumerate(PARAMETER_NAMES):
+                value = row[columns[name]] if name in columns else defaults[name]
+                number_type = int if name in INTEGER_PARAMETERS else float
+                try:
+                    values[i].append(number_type(value))
+                except (TypeError, ValueError):
+                    raise ValueError(filename + " row " + str(number) +
+                            " has an invalid " + name + ".")
+    years = np.array(values[PARAMETER_NAMES.index('num_years')], dtype=np.int64)
+    spends = np.array(values[PARAMETER_NAMES.index('annual_spend')], dtype=np.float64)
+    if not names or (years <= 0).any() or (years > 9999).any() or (spends < 0).any():
+        raise ValueError(filename + " needs at least one client, each with a "
+                "num_years from 1 to 9999 and an annual_spend of 0 or more.")
+    return names, tuple(np.array(column, dtype=years.dtype if name == 'num_years'
+            else np.float64) for name, column in zip(PARAMETER_NAMES, values))
+
+
+def write_cohort(f, names, results):
+    """Write the summary of each client of a cohort as CSV, see run_cohort()."""
+    writer = csv.writer(f)
+    writer.writerow(['client', 'success_rate', 'median_final_balance',
+            'p10_final_balance', 'median_depletion_year'])
+    for i, name in enumerate(names):
+        year = int(results['median_depletion_year'][i])
+        writer.writerow([name, format(results['success_rate'][i], '.4f'),
+                format(results['median_final'][i], '.2f'),
+                format(results['p10_final'][i], '.2f'), year if year else ""])
+
+
+
+# =========================================================================== #
+#                         Safe Withdrawal Rate Solver                         #
+# =========================================================================== #
+
+def _success_shard(job):
+    """Return the number of successful simulations in a shard job."""
+    final = _run_shard(job)[:, -1]
+    return int(np.count_nonzero(is_successful(final)))
+
+
+def _ordered_results(executor, function, jobs, pending):
+    """Yield the result of each job in order, keeping as many jobs submitted
+    to executor ahead of the one waited for as there are pending at first,
+    for solve_annual_spend().
+    Jobs not yet started are cancelled when the generator is closed."""
+    submitted = len(pending)
+    try:
+        while pending:
+            result = pending.pop(0).result()
+            if submitted < len(jobs):
+                pending.append(executor.submit(function, jobs[submitted]))
+                submitted += 1
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def success_interval(successful_count, simulations, z):
+    """Return the Wilson score interval of a success rate.
+
+    Args:
+        successful_count: number of successful simulations.
+        simulations: number of simulations run.
+        z: number of standard deviations, e.g. 1.96 for 95% confidence.
+    Returns:
+        A tuple of the lower and upper bound of the success rate.
+    """
+    p = successful_count / simulations
+    denominator = 1 + z * z / simulations
+    centre = (p + z * z / (2 * simulations)) / denominator
+    spread = z * math.sqrt(p * (1 - p) / simulations +
+            z * z / (4 * simulations * simulations)) / denominator
+    return centre - spread, centre + spread
+
+
+def solve_annual_spend(target, inflation_rate, savings_balance, interest_rate,
+            num_years, inflation_change, interest_change, simulations_to_run,
+            seed, workers=None, confidence=0.99, options=None):
+    """
+    Find the highest annual_spend that succeeds in at least target of the
+    simulations, by bisection.
+
+    Args:
+        target: required probability of success, between 0 and 1.
+        inflation_rate,
+        savings_balance,
+        interest_rate,
+        num_years,
+        inflation_change,
+        interest_change:
+        Values as for run_simulation().
+        simulations_to_run: most simulations run for any candidate spend.
+        seed: master seed, every candidate is tested on the same simulations.
+        workers: number of worker processes, defaults to the number of CPUs.
+        confidence: confidence needed to stop testing a candidate early.
+        options: optional dictionary of engine options, see run_shards().
+    Returns:
+        A dictionary of the 'annual_spend' found, its estimated 'success_rate',
+        the number of 'candidates' tested, the 'simulations' actually run and
+        the 'full_simulations' that testing every candidate in full would take.
+    Explanation:
+        Each candidate is tested on batches of SOLVE_BATCH simulations, in the
+        same order for every candidate and any number of workers. After each
+        batch the Wilson interval of its success rate is checked, and testing
+        stops as soon as the interval lies entirely above or below target, so
+        spends far from the answer cost a batch or two. Workers run the next
+        batches ahead, those not needed are cancelled and not counted.
+        A candidate whose interval still contains target after
+        simulations_to_run simulations is judged by its estimated success rate.
+        annual_spend is bisected between 0 and an upper bound, doubled from
+        savings_balance until it fails, down to a range of 1, or until both
+        ends of the range were judged that way: every spend between them is
+        then within the statistical resolution of simulations_to_run, and
+        bisecting further would only run more candidates in full.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if options is None:
+        options = {}
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    sizes = shard_sizes(simulations_to_run, SOLVE_BATCH)
+    seeds = [shard_seed(seed, index) for index in range(len(sizes))]
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    tested = {}
+    # Candidates whose interval still contained target after every batch.
+    undecided = set()
+    total = [0]
+
+    def succeeds(annual_spend):
+        parameters = (annual_spend, inflation_rate, savings_balance,
+                interest_rate, num_years, inflation_change, interest_change)
+        jobs = [(parameters, seeds[index], sizes[index], options)
+                for index in range(len(sizes))]
+        if executor is None:
+            results = (_success_shard(job) for job in jobs)
+        else:
+            # At most one batch per worker is queued ahead of the one checked.
+            pending = [executor.submit(_success_shard, job) for job in jobs[:workers]]
+            results = _ordered_results(executor, _success_shard, jobs, pending)
+        successful_count = 0
+        simulations = 0
+        decided = False
+        for size, count in zip(sizes, results):
+            successful_count += count
+            simulations += size
+            lower, upper = success_interval(successful_count, simulations, z)
+            if lower > target or upper < target:
+                decided = True
+                break
+        results.close()
+        total[0] += simulations
+        tested[annual_spend] = successful_count / simulations
+        if not decided:
+            undecided.add(annual_spend)
+        return tested[annual_spend] >= target
+
+    try:
+        low = 0
+        if not succeeds(low):
+            high = low
+        else:
+            high = max(int(savings_balance), 1)
+            while succeeds(high):
+                low = high
+                high *= 2
+            while high - low > 1 and not (low in undecided and high in undecided):
+                middle = (low + high) // 2
+                if succeeds(middle):
+                    low = middle
+                else:
+                    high = middle
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {'annual_spend': low, 'success_rate': tested[low],
+            'candidates': len(tested), 'simulations': total[0],
+            'full_simulations': len(tested) * simulations_to_run}
+
+
+
+# =========================================================================== #
+#                           Command Line Interface                            #
+# =========================================================================== #
+
+def simulate(annual_spend, inflation_rate, savings_balance, interest_rate,
+            num_years, inflation_change, interest_change, simulations_to_run,
+            seed=None, workers=None, stop_on_ruin=False, sampling='random'):
+    """
+    Run simulations_to_run simulations and return their balances, without
+    prompting, printing or writing any file.
+
+    Args:
+        annual_spend,
+        inflation_rate,
+        savings_balance,
+        interest_rate,
+        num_years,
+        inflation_change,
+        interest_change:
+        Values as for run_simulation().
+        simulations_to_run: number of simulations to run.
+        seed: master seed, results are reproducible for the same seed. A random
+            seed is used if omitted.
+        workers: number of worker processes, defaults to the number of CPUs.
+        stop_on_ruin: stop a simulation once its balance is negative, its
+            balance then stays at that value.
+        sampling: scheme the shocks are drawn with, one of SAMPLING_SCHEMES.
+    Returns:
+        An array of shape (simulations_to_run, num_years), row i holds the
+        savings balances of simulation i.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    return run_parallel(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            simulations_to_run, seed, workers,
+            {'stop_on_ruin': stop_on_ruin, 'sampling': sampling})
+
+
+def positive_integer(value):
+    """argparse type for an integer greater than zero."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return number
+
+
+def non_negative_integer(value):
+    """argparse type for an integer of zero or more."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("must be a non-negative integer")
+    return number
+
+
+def build_parser():
+    """Return the argument parser of the command line interface."""
+    parser = argparse.ArgumentParser(
+        description="Run Monte Carlo simulations of a savings balance after "
+            "yearly spending, inflation and interest. Without any simulation "
+            "parameters the interactive prompts are used.")
+    parameters = parser.add_argument_group("simulation parameters")
+    parameters.add_argument('--annual-spend', type=non_negative_integer,
+        help="amount spent last year to support your current lifestyle")
+    parameters.add_argument('--inflation-rate', type=float,
+        help="base inflation rate, e.g. 0.02 for 2%%")
+    parameters.add_argument('--inflation-change', type=float,
+        help="expected maximum change for inflation in a given year")
+    parameters.add_argument('--savings-balance', type=int,
+        help="amount currently saved for investment")
+    parameters.add_argument('--interest-rate', type=float,
+        help="base annual interest rate, e.g. 0.04 for 4%%")
+    parameters.add_argument('--interest-change', type=float,
+        help="expected maximum change for interest in a given year")
+    parameters.add_argument('--num-years', type=positive_integer,
+        help="number of years to test")
+    parameters.add_argument('--simulations', type=positive_integer,
+        dest='simulations_to_run', help="number of simulations to run")
+    parser.add_argument('--output',
+        help="output file, defaults to output.txt, or output.fib for binary")
+    parser.add_argument('--format', choices=('text', 'binary', 'summary'),
+        default='text', dest='output_format',
+        help="write every balance as text or binary, or only print a summary")
+    parser.add_argument('--seed', type=non_negative_integer,
+        help="master seed, makes the results reproducible")
+    parser.add_argument('--workers', type=positive_integer,
+        help="number of worker processes, defaults to the number of CPUs")
+    parser.add_argument('--memory-limit', type=positive_integer, metavar='MB',
+        help="keep the run within MB megabytes of memory, by running fewer "
+            "simulations at once per worker, or fewer workers, if needed. "
+            "Results for a seed then depend on MB and --num-years")
+    parser.add_argument('--float32', action='store_true',
+        help="with --format binary, store the balances as float32, halving "
+            "the file. The summary still uses full precision, and the effect "
+            "of rounding on the success rate is reported")
+    parser.add_argument('--year-step', type=positive_integer, default=1,
+        metavar='K',
+        help="with --format binary, only store every K'th year of each "
+            "simulation, and its final year")
+    parser.add_argument('--flush-size', type=positive_integer,
+        default=FLUSH_SIZE // 1024, metavar='KB',
+        help="with --format text, kilobytes of formatted output buffered "
+            "between writes to the file. Defaults to 4096")
+    parser.add_argument('--sweep', type=parse_sweep, action='append', default=[],
+        metavar='NAME=VALUES',
+        help="evaluate every combination of values of a parameter, as "
+            "start:stop:step or a comma separated list, e.g. "
+            "annual_spend=30000:60000:5000. May be repeated. Writes the success "
+            "rate of each combination as CSV to --output, or the console")
+    parser.add_argument('--stop-on-ruin', action='store_true',
+        help="stop a simulation once its balance is negative, it then keeps "
+            "that balance for its remaining years")
+    parser.add_argument('--solve', type=float, metavar='TARGET',
+        help="find the highest annual spend that succeeds in at least TARGET "
+            "of the simulations, e.g. 0.95. --annual-spend is not needed")
+    parser.add_argument('--history', metavar='CSV',
+        help="draw each year's inflation and return from blocks of historical "
+            "years in CSV, with 'inflation' and 'return' columns, instead of "
+            "random walks. The rate and change parameters are then not needed")
+    parser.add_argument('--block-size', type=positive_integer, default=5,
+        help="number of consecutive historical years drawn together, "
+            "defaults to 5")
+    parser.add_argument('--sampling', choices=SAMPLING_SCHEMES, default='random',
+        help="draw the rate shocks independently, as antithetic pairs, or as "
+            "randomly shifted lattice points (quasi-Monte Carlo), which reach a "
+            "given precision with fewer simulations. Defaults to random")
+    parser.add_argument('--precision', type=float, metavar='EPSILON',
+        help="with --format summary, stop once the confidence interval of the "
+            "success rate is within EPSILON, e.g. 0.005 for +/-0.5%%. "
+            "--simulations is then the most simulations run")
+    parser.add_argument('--confidence', type=float, default=0.95,
+        help="confidence level of the --precision interval, defaults to 0.95")
+    parser.add_argument('--resume', metavar='FILE',
+        help="finish an interrupted text or binary run written to FILE, from "
+            "its last checkpoint. The simulation parameters are not needed")
+    parser.add_argument('--top-up', type=positive_integer, default=0, metavar='N',
+        help="with --resume, add N more simulations to the run")
+    parser.add_argument('--cohort', metavar='CSV',
+        help="simulate every client profile in CSV, one row per client with a "
+            "column for each parameter and an optional 'client' column, and "
+            "write each client's success rate, median and 10th percentile "
+            "final balance and median year of depletion as CSV to --output, "
+            "or the console. Parameters with no column are taken from the "
+            "command line")
+    parser.add_argument('--cache', metavar='DIR',
+        help="reuse the results of identical previous runs stored in DIR, "
+            "runs need a --seed to be found again")
+    parser.add_argument('--cache-size', type=positive_integer,
+        default=CACHE_SIZE // 1024 // 1024, metavar='MB',
+        help="most megabytes kept in the cache, the least recently used runs "
+            "are removed first. Defaults to 1024")
+    parser.add_argument('--profile', action='store_true',
+        help="report the time, calls and throughput of each stage of the run")
+    parser.add_argument('--profile-output', metavar='FILE',
+        help="also save cProfile statistics to FILE, for pstats or snakeviz. "
+            "The shards then run in a single process, so they are profiled")
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the command line interface.
+
+    Args:
+        argv: list of arguments, defaults to sys.argv.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.resume is not None:
+        resume(parser, args)
+        return
+    if args.top_up:
+        parser.error("--top-up needs --resume")
+    if (args.float32 or args.year_step > 1) and args.output_format != "binary":
+        parser.error("--float32 and --year-step only work with --format binary")
+    if args.memory_limit is not None and (args.sweep or args.solve is not None or
+            args.cohort is not None):
+        parser.error("--memory-limit cannot be used with --sweep, --solve or "
+            "--cohort")
+    if args.cohort is not None:
+        cohort(parser, args)
+        return
+    # Swept parameters do not need a single value.
+    swept = dict(args.sweep)
+    for name in swept:
+        setattr(args, name, swept[name][0])
+    names = PARAMETER_NAMES + ('simulations_to_run',)
+    missing = [name for name in names if getattr(args, name) is None]
+    # No parameters, fall back to the interactive prompts.
+    if len(missing) == len(names) and args.solve is None:
+        begin()
+        return
+    # The solver searches for annual_spend itself.
+    if args.solve is not None and 'annual_spend' in missing:
+        missing.remove('annual_spend')
+        args.annual_spend = 0
+    # Historical rates replace the base rates and their changes.
+    if args.history is not None:
+        for name in ('inflation_rate', 'interest_rate', 'inflation_change',
+                'interest_change'):
+            if name in missing:
+                missing.remove(name)
+                setattr(args, name, 0.0)
+    if missing:
+        options = {name: "--" + name.replace('_', '-') for name in PARAMETER_NAMES}
+        options['simulations_to_run'] = "--simulations"
+        parser.error("missing simulation parameters: " + ", ".join(
+            options[name] for name in missing))
+
+    parameters = tuple(getattr(args, name) for name in PARAMETER_NAMES)
+    options = {'stop_on_ruin': args.stop_on_ruin, 'sampling': args.sampling}
+    if args.float32:
+        options['dtype'] = np.dtype(np.float32).str
+    if args.year_step > 1:
+        options['year_step'] = args.year_step
+    if args.precision is not None:
+        if args.output_format != "summary" or swept or args.solve is not None:
+            parser.error("--precision only works with --format summary")
+        if not 0 < args.precision < 1 or not 0 < args.confidence < 1:
+            parser.error("--precision and --confidence must be between 0 and 1")
+    if args.history is not None:
+        if swept:
+            parser.error("--history cannot be used with --sweep")
+        if args.sampling != 'random':
+            parser.error("--history cannot be used with --sampling")
+        try:
+            options['history'] = load_history(args.history, args.block_size)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    seed = args.seed
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    timer = None
+    profiler = None
+    if args.profile or args.profile_output:
+        if swept or args.solve is not None:
+            parser.error("--profile cannot be used with --sweep or --solve")
+        timer = StageTimer()
+        options['timer'] = timer
+    if args.profile_output:
+        # cProfile only sees the process it is enabled in.
+        args.workers = 1
+    if args.memory_limit is not None:
+        try:
+            options['shard_size'], args.workers = plan_memory(args.num_years,
+                    args.memory_limit * 1024 * 1024, args.workers,
+                    args.output_format, options)
+        except ValueError as error:
+            parser.error(str(error))
+        print("Running " + str(options['shard_size']) + " simulations at once "
+            "on each of " + str(args.workers) + " workers to stay within " +
+            str(args.memory_limit) + " MB")
+    if args.profile_output:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    run_start = time.perf_counter()
+
+    if args.solve is not None:
+        if not 0 < args.solve <= 1:
+            parser.error("--solve must be between 0 and 1")
+        result = solve_annual_spend(args.solve, *parameters[1:],
+                args.simulations_to_run, seed, args.workers, options=options)
+        print("Highest annual spend succeeding in at least " +
+            format(args.solve * 100, '.2f') + "% of simulations: " +
+            str(result['annual_spend']) + " (" +
+            format(result['success_rate'] * 100, '.2f') + "%)")
+        print("Tested " + str(result['candidates']) + " candidates with " +
+            str(result['simulations']) + " simulations (" +
+            str(result['full_simulations']) + " without early stopping)")
+        print("Seed: " + str(seed))
+        return
+
+    if swept:
+        grid = {name: swept.get(name, getattr(args, name)) for name in PARAMETER_NAMES}
+        grid, success = run_sweep(grid, args.simulations_to_run, seed, args.workers,
+                options)
+        if args.output is None:
+            write_sweep(sys.stdout, grid, success)
+        else:
+            with open(args.output, 'w', newline='') as f:
+                write_sweep(f, grid, success)
+        print("Seed: " + str(seed), file=sys.stderr)
+        return
+
+    if args.precision is not None:
+        # Runs of unknown size are not cached.
+        summary = run_to_precision(*parameters, args.simulations_to_run, seed,
+                args.precision, args.confidence, args.workers, options)
+        bytes_written, write_time, cached = 0, 0, False
+    else:
+        cache = None
+        if args.cache is not None:
+            cache = ResultCache(args.cache, args.cache_size * 1024 * 1024)
+        filename = args.output
+        if filename is None:
+            filename = 'output.fib' if args.output_format == "binary" else 'output.txt'
+        summary, bytes_written, write_time, cached = run_cached(cache, filename,
+                args.output_format, parameters, args.simulations_to_run, seed,
+                args.workers, options, args.flush_size * 1024)
+    print_summary(summary)
+    print("Seed: " + str(seed))
+    if args.precision is not None:
+        half_width = success_half_width(summary, args.confidence)
+        if half_width is not None and half_width <= args.precision:
+            print("Reached +/-" + format(half_width * 100, '.2f') +
+                "% at " + format(args.confidence * 100, '.0f') + "% confidence "
+                "after " + str(summary['simulations']) + " simulations")
+        else:
+            print("Did not reach +/-" + format(args.precision * 100, '.2f') +
+                "% within " + str(args.simulations_to_run) + " simulations")
+    if cached:
+        print("Results served from the cache in " + os.path.abspath(args.cache))
+    elif args.output_format != "summary":
+        print_write_speed(bytes_written, write_time)
+    if args.output_format != "summary":
+        print_precision(read_checkpoint(filename))
+        print("Results written to " + os.path.abspath(filename))
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_output)
+    if timer is not None:
+        timer.add('total', time.perf_counter() - run_start, summary['simulations'])
+        timer.report()
+    if profiler is not None:
+        print("Profile written to " + os.path.abspath(args.profile_output))
+
+
+
+def resume(parser, args):
+    """Resume or top up the run written to args.resume, for main()."""
+    try:
+        checkpoint = read_checkpoint(args.resume)
+        options = {'stop_on_ruin': checkpoint['stop_on_ruin'],
+                'sampling': checkpoint.get('sampling', 'random'),
+                'shard_size': checkpoint.get('shard_size', SHARD_SIZE),
+                'dtype': checkpoint.get('dtype', np.dtype(np.float64).str),
+                'year_step': checkpoint.get('year_step', 1)}
+        if args.history is not None:
+            options['history'] = load_history(args.history, args.block_size)
+        if args.memory_limit is not None:
+            # The run keeps its shard size, only the workers can change.
+            args.workers = plan_memory(checkpoint['parameters']['num_years'],
+                    args.memory_limit * 1024 * 1024, args.workers,
+                    checkpoint['format'], options, options['shard_size'])[1]
+        done = checkpoint['simulations']
+        summary, bytes_written, write_time = resume_results(args.resume,
+                args.top_up, args.workers, options, args.flush_size * 1024)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    print_summary(summary)
+    print("Seed: " + str(checkpoint['seed']))
+    print("Added " + str(summary['simulations'] - done) + " simulations to the " +
+        str(done) + " already written")
+    # A partial last shard is kept as it is, the added simulations start the
+    # next shard's stream.
+    planned = checkpoint['simulations_to_run']
+    if args.top_up and planned % options['shard_size']:
+        print("The run ended with a partial shard, so simulations from " +
+            str(planned - planned % options['shard_size'] + 1) + " on differ from "
+            "a single run of " + str(summary['simulations']) + " with the same seed")
+    print_write_speed(bytes_written, write_time)
+    print_precision(read_checkpoint(args.resume))
+    print("Results written to " + os.path.abspath(args.resume))
+
+
+def cohort(parser, args):
+    """Simulate the client profiles in args.cohort, for main()."""
+    if args.sweep or args.solve is not None or args.precision is not None:
+        parser.error("--cohort cannot be used with --sweep, --solve or --precision")
+    if args.simulations_to_run is None:
+        parser.error("missing simulation parameters: --simulations")
+    options = {'stop_on_ruin': args.stop_on_ruin, 'sampling': args.sampling}
+    defaults = {name: getattr(args, name) for name in PARAMETER_NAMES}
+    try:
+        if args.history is not None:
+            if args.sampling != 'random':
+                parser.error("--history cannot be used with --sampling")
+            options['history'] = load_history(args.history, args.block_size)
+            # Historical rates replace the base rates and their changes.
+            for name in ('inflation_rate', 'interest_rate', 'inflation_change',
+                    'interest_change'):
+                defaults[name] = 0.0
+        names, clients = load_cohort(args.cohort, defaults)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    seed = args.seed
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    start = time.perf_counter()
+    results = run_cohort(clients, args.simulations_to_run, seed, args.workers,
+            options)
+    elapsed = time.perf_counter() - start
+    if args.output is None:
+        write_cohort(sys.stdout, names, results)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            write_cohort(f, names, results)
+    print("Simulated " + str(len(names)) + " clients with " +
+        str(args.simulations_to_run) + " simulations each in " +
+        format(elapsed, '.2f') + " seconds", file=sys.stderr)
+    print("Seed: " + str(seed), file=sys.stderr)
+
+
+
+# =========================================================================== #
+#                                Functions                                    #
+# =========================================================================== #
+
+def run_again():
+    """ 
+    Prompt to input 'Q' to Quit, or 'R' to Restart the application.
+    """
+    decision = str(input("--------------------------\nWhat would you like to do?\n'Quit' or 'Restart'?\n "))
+    if decision.upper() == "QUIT" or decision.upper() == "Q":
+        print("--------------------------\nfi.py has closed.\n--------------------------")
+        quit()
+    elif decision.upper() == "RESTART" or decision.upper() == "R":
+        print("--------------------------\nfi.py has restarted.\n--------------------------")
+        begin()
+    else:
+        print("--------------------------\n\n", decision, "is not a valid option.\n")
+        run_again()
+
+
+def run_simulation(annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change,
+            stop_on_ruin=False):
+    """ 
+    Calculates savings_balance value after yearly expenses, taking into account 
+    interest and inflation rates. Interest and inflation values undergo randomization each iteration.
+
+    Args:
+        annual_spend,
+        inflation_rate,
+        savings_balance,
+        interest_rate,
+        num_years,
+        inflation_change,
+        interest_change:
+        Validated values input by the user.
+        stop_on_ruin: stop once savings_balance is negative.
+    Returns: 
+        An array of floats, representing the users saving balance after spending, interest and inflation.
+        With stop_on_ruin, the array ends at the first negative balance, its
+        length is the year of depletion.
+    Explanation:
+    Loop for int(num_years):
+        annual_spend is adjusted by inflation_rate. 
+        Adjusted annual_spend is subtracted from savings_balance.
+        interest_rate is applied to remaining savings_balance.
+        Final savings_balance is appended to ???San array.
+        If stop_on_ruin and savings_balance is negative, stop.
+    End loop.
+    return array.
+    """
+    results = []
+    for i in range(0, num_years):
+        annual_spend = annual_spend + (annual_spend * inflation_rate)
+        savings_balance = savings_balance - annual_spend
+        savings_balance = savings_balance + (savings_balance * interest_rate)
+
+        inflation_rate = modify_rate(inflation_rate, inflation_change)
+        interest_rate = modify_rate(interest_rate, interest_change)
+
+        results.append(savings_balance)
+        if stop_on_ruin and savings_balance < 0:
+            break
+
+    return results
+
+
+def modify_rate(rate, change):
+    """
+    Calculate a random value within change of the given rate
+
+    Args:
+        rate: the initial rate to change from
+        change: the maximum amount to add or subtract from the rate
+    Returns:
+        random value within change of the given rate
+    Explanation:
+        random.random() calculates a random value between 0 and 1.
+        Thus random.random() * 2 gives a value between 0 and 2,
+        so 1 - random.random() * 2 gives a value between -1 and 1.
+        Multiplying by change gives a value between -change and change,
+        which is then added to the rate.
+    """
+    return rate + change * (0.75 - random.random() * 2.5)
+
+
+def begin():
+    """
+    Will cause the application to prompt user for input, validate, store
+    and process the input. 
+
+    Processed data is written to file 'output.txt', or 'output.fib' for binary
+    results, which will be created and stored in the same directory as 'fi.py'.
+    """
+
+    # Ask which format the results should be written in.
+    output_format = get_output_format()
+    if output_format == "binary":
+        filename = 'output.fib'
+    else:
+        filename = 'output.txt'
+
+    # Confirm the output file can be opened or created, and written to.
+    try:
+        with open(filename, '+w') as f:
+            f.write("")
+    # Instruct user how to resolve the error then close the application.            
+    except IOError:
+        input("\nError accessing " + filename + " from:\n" + os.getcwd() +
+        "\nCheck you have permissions to read and write to files in this " +
+        "directory then try again.\n\nPress and 'Enter' or 'Return' to quit the application.")
+        quit()
+
+    # Get values from the user to so the calculations can be run.
+    annual_spend = get_annual_spend()
+    inflation_rate = get_inflation_rate()
+    inflation_change = get_inflation_change()
+    savings_balance = get_savings_balance()
+    interest_rate = get_interest_rate()
+    interest_change = get_interest_change()
+    num_years = get_num_years()
+    simulations_to_run = get_simulations_to_run()
+    seed = get_seed()
+    # Only a seeded run can be found again, and the cache is opt in as it keeps
+    # a copy of every output file.
+    use_cache = seed is not None and get_use_cache()
+    # Without a seed, draw one so it can be reported and the run reproduced.
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    # 'run_cached' runs the simulations, sharing them out between all CPUs,
+    # and writes the savings balances remaining after expenses for each year of
+    # each simulation to the output file. If the cache was chosen, a run
+    # repeated with the same seed is copied from it instead.
+    parameters = (annual_spend, inflation_rate, savings_balance,
+            interest_rate, num_years, inflation_change, interest_change)
+    cache = None
+    if use_cache:
+        try:
+            cache = ResultCache(CACHE_DIR)
+        except OSError:
+            pass
+    summary, bytes_written, write_time, cached = run_cached(cache, filename,
+            output_format, parameters, simulations_to_run, seed)
+
+    # Summarize the results, and write them to the console.
+    print_summary(summary)
+    print("Seed: " + str(seed))
+    if cached:
+        print("Results served from the cache in " + os.path.abspath(CACHE_DIR))
+    else:
+        print_write_speed(bytes_written, write_time)
     print("----------------------------------------------")
-    print("See 'output.txt' located in directory:\n" + os.getcwd() +  ". for more detailed results.")
+    print("See '" + filename + "' located in directory:\n" + os.getcwd() +  ". for more detailed results.")
     # Once processing has finished, prompt user to 'Quit' or 'Restart' the application.
     run_again()
 
 
 
-# Entry point for application
-begin()
\ No newline at end of file
+# Entry point for application, guarded so fi.py can be imported, by worker
+# processes or other scripts, without starting the application.
+if __name__ == "__main__":
+    main()
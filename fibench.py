@@ -0,0 +1,239 @@
+"""
+
+Financial Independence Benchmarks
+
+Measures how the simulation engine, the output writers and the GUI's result
+parsers scale with num_years and simulations_to_run. Runs without prompts or a
+display, and saves its measurements as JSON so runs can be compared between
+versions.
+
+Version: 1.0
+
+"""
+
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import fi
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Parameters of every benchmarked run, num_years is replaced by each size.
+BENCH_PARAMETERS = (40000, 0.02, 1000000, 0.04, 30, 0.0025, 0.01)
+# (num_years, simulations_to_run) measured by default, up to the largest run
+# the console application accepts.
+DEFAULT_SIZES = ((30, 1000), (100, 9999), (1000, 1000), (1000, 9999), (9999, 9999))
+# The pure Python run_simulation() is skipped above this many balances.
+SCALAR_LIMIT = 10 ** 7
+# Stages in the order they run, later stages read the files earlier ones wrote.
+STAGES = ('scalar', 'batch', 'streaming', 'write_text', 'write_binary',
+          'parse_text', 'parse_binary')
+# Stage writing the file each parse stage reads, run unmeasured first when it
+# is not one of the stages measured.
+PARSE_INPUTS = {'parse_text': 'write_text', 'parse_binary': 'write_binary'}
+SEED = 1
+
+
+
+# =========================================================================== #
+#                                 Functions                                   #
+# =========================================================================== #
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process, or of its largest
+    worker process, in MB, or None where it cannot be measured."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    if platform.system() == 'Darwin':
+        return peak / 1e6
+    return peak * 1024 / 1e6
+
+
+def run_stage(stage, num_years, simulations_to_run, directory, workers):
+    """
+    Run and time a single stage in the current process.
+
+    Args:
+        stage: name of the stage, one of STAGES.
+        num_years: number of years in each simulation.
+        simulations_to_run: number of simulations.
+        directory: directory the output files are written to and read from.
+        workers: number of worker processes for the simulation engine.
+    Returns:
+        A dictionary of the measurements of the stage, or None if skipped.
+    Explanation:
+        Write stages compute their results before the timer starts, so only
+        formatting and writing is measured. Parse stages run figui's
+        LoadResults(), what the window runs on its loading thread, computing
+        the statistics of every simulation and the fan chart bands.
+    """
+    parameters = BENCH_PARAMETERS[:4] + (num_years,) + BENCH_PARAMETERS[5:]
+    text_file = os.path.join(directory, 'output.txt')
+    binary_file = os.path.join(directory, 'output.fib')
+    baseline = peak_rss_mb()
+    processed = 0
+
+    if stage == 'scalar':
+        if num_years * simulations_to_run > SCALAR_LIMIT:
+            return None
+        random.seed(SEED)
+        start = time.perf_counter()
+        for i in range(simulations_to_run):
+            fi.run_simulation(*parameters)
+        seconds = time.perf_counter() - start
+
+    elif stage == 'batch':
+        start = time.perf_counter()
+        fi.run_parallel(*parameters, simulations_to_run, SEED, workers)
+        seconds = time.perf_counter() - start
+
+    elif stage == 'streaming':
+        start = time.perf_counter()
+        fi.run_streaming(*parameters, simulations_to_run, SEED, workers)
+        seconds = time.perf_counter() - start
+
+    elif stage in ('write_text', 'write_binary'):
+        balances = fi.run_parallel(*parameters, simulations_to_run, SEED, workers)
+        start = time.perf_counter()
+        if stage == 'write_text':
+            with open(text_file, 'wb') as f:
+                processed = fi.write_text(f, balances)
+        else:
+            header = fi.new_binary_header(parameters, SEED)
+            with open(binary_file, 'wb') as f:
+                fi.write_binary_header(f, header)
+                processed = fi.write_binary(f, header, balances)
+                processed += fi.finish_binary(f, header,
+                        fi.is_successful(balances[:, -1]))
+        seconds = time.perf_counter() - start
+
+    elif stage in ('parse_text', 'parse_binary'):
+        # figui.py needs tkinter to import, even though no window is created.
+        try:
+            import figui
+        except ImportError:
+            return None
+        filename = text_file if stage == 'parse_text' else binary_file
+        results = queue.Queue()
+        start = time.perf_counter()
+        figui.LoadResults(filename, stage == 'parse_binary', results,
+                threading.Event())
+        seconds = time.perf_counter() - start
+        while not results.empty():
+            kind, rows, processed = results.get()
+        if kind != 'done':
+            raise ValueError(filename + " could not be loaded: " + kind)
+
+    return {'stage': stage, 'num_years': num_years,
+            'simulations': simulations_to_run, 'seconds': seconds,
+            'paths_per_second': simulations_to_run / max(seconds, 1e-9),
+            'bytes': processed,
+            'megabytes_per_second': processed / 1e6 / max(seconds, 1e-9),
+            'baseline_rss_mb': baseline, 'peak_rss_mb': peak_rss_mb()}
+
+
+def measure(stage, num_years, simulations_to_run, directory, workers):
+    """Run a stage in a freshly spawned process, so its peak memory is not
+    inflated by earlier stages."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stage, stage, num_years, simulations_to_run,
+                directory, workers).result()
+
+
+def parse_size(text):
+    """argparse type for a size, 'YEARSxSIMULATIONS'."""
+    try:
+        num_years, simulations_to_run = (int(value) for value in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("sizes must look like 30x1000")
+    if num_years <= 0 or simulations_to_run <= 0:
+        raise argparse.ArgumentTypeError("sizes must be positive")
+    return num_years, simulations_to_run
+
+
+def compare(results, previous):
+    """Write the speed up of each measurement over a previous run to the
+    console."""
+    before = {(row['stage'], row['num_years'], row['simulations']): row
+              for row in previous['results']}
+    for row in results['results']:
+        old = before.get((row['stage'], row['num_years'], row['simulations']))
+        if old is not None:
+            print("{0:<13} {1:>5}x{2:<6} {3:>8.2f}x faster".format(
+                row['stage'], row['num_years'], row['simulations'],
+                old['seconds'] / max(row['seconds'], 1e-9)))
+
+
+def main(argv=None):
+    """Run every stage at every size and save the measurements as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark fi.py and figui.py.")
+    parser.add_argument('--sizes', type=parse_size, nargs='+',
+        default=list(DEFAULT_SIZES), metavar='YEARSxSIMULATIONS',
+        help="sizes to measure, e.g. 30x1000 9999x9999")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+        help="stages to measure, defaults to all")
+    parser.add_argument('--workers', type=int,
+        help="worker processes for the simulation engine, defaults to the number of CPUs")
+    parser.add_argument('--output', default='bench.json',
+        help="file the measurements are saved to, defaults to bench.json")
+    parser.add_argument('--compare', metavar='JSON',
+        help="previous measurements to report the speed up against")
+    args = parser.parse_args(argv)
+
+    results = {'python': platform.python_version(), 'numpy': np.__version__,
+               'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+               'workers': args.workers, 'results': []}
+    for num_years, simulations_to_run in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            for stage in STAGES:
+                if stage not in args.stages:
+                    continue
+                if PARSE_INPUTS.get(stage, stage) not in args.stages:
+                    run_stage(PARSE_INPUTS[stage], num_years, simulations_to_run,
+                            directory, args.workers)
+                row = measure(stage, num_years, simulations_to_run, directory,
+                        args.workers)
+                if row is None:
+                    print("{0:<13} {1:>5}x{2:<6} skipped".format(
+                        stage, num_years, simulations_to_run))
+                    continue
+                results['results'].append(row)
+                print("{0:<13} {1:>5}x{2:<6} {3:>9.3f}s {4:>12.0f} paths/s "
+                      "{5:>9.2f} MB/s {6:>9} MB peak".format(
+                    stage, num_years, simulations_to_run, row['seconds'],
+                    row['paths_per_second'], row['megabytes_per_second'],
+                    format(row['peak_rss_mb'], '.1f') if row['peak_rss_mb'] else "-"))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Measurements written to " + os.path.abspath(args.output))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+
+# Entry point for the benchmarks.
+if __name__ == "__main__":
+    main()
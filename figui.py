@@ -17,10 +17,69 @@ from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
 import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from fi import (BAND_QUANTILES, BINARY_MAGIC, YearlyQuantileSketch, band_years,
+        is_successful, kept_years, read_bands, read_binary, read_index,
+        read_simulation, write_bands)
+
+# Number of characters read from a text result file at a time.
+READ_CHUNK_SIZE = 1024 * 1024
+# Number of simulations the loading thread parses before posting them to the
+# window, and how often (in milliseconds) the window checks for them.
+LOAD_BATCH_SIZE = 1000
+POLL_INTERVAL = 100
+# Number of rows of the simulation browser that exist as Treeview items, only
+# the simulations scrolled into view are materialized.
+VISIBLE_ROWS = 15
+# Size of the fan chart canvas before the window is resized, and the margin
+# left around the plot for its labels, in pixels.
+CHART_WIDTH = 660
+CHART_HEIGHT = 220
+CHART_MARGIN = 40
 
 maximums = []
 minimums = []
 averages = []
+finals = []
+successes = []
+# Statistics the simulation browser can be sorted by, by column name.
+SORT_COLUMNS = {'maximum': maximums, 'minimum': minimums,
+                'average': averages, 'final': finals}
+# Memory mapped balances of an open binary result file, a simulation's row is
+# only read from disk when it is selected.
+binary_results = None
+# Filename, header and records of an open file's summary index, a simulation's
+# balances are then only read when needed, see SimulationBalances().
+indexed_results = None
+# Queue the loading thread posts its progress to, and the event used to cancel
+# it. Replaced each time a file is opened.
+load_queue = None
+load_cancel = None
+load_start = 0
+# State of the simulation browser: position of the first visible row, the
+# selected simulation, and the column it is sorted by. sort_index lists
+# simulation indexes in sorted order, simulations loaded after it was built
+# follow in file order. sort_positions is its inverse, built when needed.
+view_offset = 0
+selected_simulation = None
+sort_column = None
+sort_descending = False
+sort_index = None
+sort_positions = None
+# Fan chart: the years and BAND_QUANTILES percentiles of the balance across
+# every simulation, computed once while loading, and the selected simulation's
+# balance in those years. Redraws only ever use these.
+bands = None
+selected_path = None
+# Years, counting from 0, of each stored column of an open binary file that
+# keeps only every year_step'th year, see kept_years(). None when every year
+# is stored, the band years are then the years themselves.
+stored_years = None
 
 
 
@@ -28,142 +87,605 @@ averages = []
 #                                 Functions                                   #
 # =========================================================================== #
 
+def ReadLines(f, chunk_size=READ_CHUNK_SIZE):
+    """Yield each line of an open text file, without its line ending, reading
+    the file chunk_size characters at a time."""
+    remainder = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split('\n')
+        # The last element is an incomplete line, unless the chunk ended on
+        # a line ending, carry it into the next chunk.
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def ParseBalances(line):
+    """Parse a line of a text result file in a single pass.
+
+    Returns:
+        A tuple of the list of balances and whether the simulation was
+        successful.
+    Raises:
+        ValueError: if the line is incorrectly formatted.
+    """
+    # The string 'successful' or 'unsuccessful' is the last value of each line,
+    # every other value is converted to a float exactly once.
+    values = line.split(' ')
+    status = values.pop()
+    balances = list(map(float, values))
+    if not balances:
+        raise ValueError("Line has no balances.")
+    return balances, status.strip() == "successful"
+
+
+def RowStatistics(balances, successful):
+    """Return the maximum, minimum, average and final balance of a list of
+    balances, and successful."""
+    return (max(balances), min(balances), sum(balances) / len(balances),
+            balances[-1], successful)
+
+
+def LoadResults(filename, is_binary, results_queue, cancel, statistics=True,
+            compute_bands=True):
+    """Compute the statistics of each simulation in a result file, and the fan
+    chart bands of the whole file, in a single pass. Run on a background
+    thread so the window stays responsive.
+
+    Never touches the widgets, instead posts messages to results_queue, each a
+    tuple of (kind, rows, bytes_read):
+        'rows': rows is a list of up to LOAD_BATCH_SIZE tuples, see RowStatistics(),
+            empty unless statistics is set.
+        'bands': rows is a (years, bands) tuple, posted before 'done' if
+            compute_bands is set. The bands are also saved next to the file.
+        'done', 'cancelled', 'invalid' or 'unreadable': loading has stopped.
+    """
+    bytes_read = 0
+    rows = []
+    # Balances of the batch in the band years, created from the first row.
+    sampled = []
+    sketch = None
+    try:
+        if is_binary:
+            header, balances, successful = read_binary(filename)
+            if compute_bands:
+                sketch = YearlyQuantileSketch(band_years(header['years']))
+            for start in range(0, header['simulations'], LOAD_BATCH_SIZE):
+                if cancel.is_set():
+                    results_queue.put(('cancelled', None, bytes_read))
+                    return
+                batch = np.asarray(balances[start:start + LOAD_BATCH_SIZE],
+                        dtype=np.float64)
+                if statistics:
+                    rows = list(zip(batch.max(axis=1).tolist(),
+                            batch.min(axis=1).tolist(), batch.mean(axis=1).tolist(),
+                            batch[:, -1].tolist(),
+                            successful[start:start + LOAD_BATCH_SIZE].tolist()))
+                if sketch is not None:
+                    sketch.add(batch[:, sketch.years])
+                bytes_read += batch.size * balances.itemsize
+                results_queue.put(('rows', rows, bytes_read))
+        else:
+            with open(filename, 'r') as f:
+                for line in ReadLines(f):
+                    balances, successful = ParseBalances(line)
+                    if statistics:
+                        rows.append(RowStatistics(balances, successful))
+                    if compute_bands:
+                        if sketch is None:
+                            sketch = YearlyQuantileSketch(band_years(len(balances)))
+                            years = sketch.years.tolist()
+                        sampled.append([balances[year] for year in years])
+                    bytes_read += len(line) + 1
+                    if len(sampled) == LOAD_BATCH_SIZE or len(rows) == LOAD_BATCH_SIZE:
+                        if cancel.is_set():
+                            results_queue.put(('cancelled', None, bytes_read))
+                            return
+                        if sampled:
+                            sketch.add(sampled)
+                        results_queue.put(('rows', rows, bytes_read))
+                        rows = []
+                        sampled = []
+            if sampled:
+                sketch.add(sampled)
+            results_queue.put(('rows', rows, bytes_read))
+    except (ValueError, IndexError):
+        # Rows of different lengths do not fit the bands.
+        results_queue.put(('invalid', None, bytes_read))
+        return
+    except IOError:
+        results_queue.put(('unreadable', None, bytes_read))
+        return
+    if sketch is not None:
+        result = (sketch.years, sketch.quantiles(BAND_QUANTILES))
+        try:
+            write_bands(filename, *result)
+        except OSError:
+            # The bands are then computed again next time the file is opened.
+            pass
+        results_queue.put(('bands', result, bytes_read))
+    results_queue.put(('done', None, bytes_read))
+
+
+def StartLoading(filename, is_binary, statistics=True):
+    """Start loading a result file on a background thread, and poll it for
+    progress from the Tk loop. The fan chart bands saved by an earlier load
+    are reused, without statistics there is then nothing left to load."""
+    global load_queue, load_cancel, load_start, bands, stored_years
+    CancelLoading()
+    stored_years = None
+    if is_binary:
+        try:
+            header = read_binary(filename)[0]
+        except (ValueError, OSError):
+            header = {}
+        if header.get('year_step', 1) > 1:
+            stored_years = kept_years(header['parameters']['num_years'],
+                    header['year_step'])
+    bands = read_bands(filename)
+    DrawFanChart()
+    if bands is not None and not statistics:
+        return
+    load_queue = queue.Queue()
+    load_cancel = threading.Event()
+    load_start = time.perf_counter()
+    threading.Thread(target=LoadResults, daemon=True,
+            args=(filename, is_binary, load_queue, load_cancel, statistics,
+                  bands is None)).start()
+    btn_cancel['state'] = 'normal'
+    txt_progress.set("Loading...")
+    root.after(POLL_INTERVAL, PollLoading, load_queue, filename)
+
+
+def CancelLoading():
+    """Ask the loading thread, if any, to stop. Simulations already loaded
+    remain available."""
+    if load_cancel is not None:
+        load_cancel.set()
+    btn_cancel['state'] = 'disabled'
+
+
+def PollLoading(results_queue, filename):
+    """Add the simulations posted by the loading thread to the lists and
+    widgets, reschedules itself until loading has stopped."""
+    global bands
+    # Ignore a loader that has been replaced by a newer one.
+    if results_queue is not load_queue:
+        return
+    finished = None
+    bytes_read = 0
+    try:
+        while finished is None:
+            kind, rows, bytes_read = results_queue.get_nowait()
+            if kind == 'rows':
+                for maximum, minimum, average, final, successful in rows:
+                    maximums.append(maximum)
+                    minimums.append(minimum)
+                    averages.append(average)
+                    finals.append(final)
+                    successes.append(successful)
+            elif kind == 'bands':
+                bands = rows
+                SelectPath(selected_simulation)
+            else:
+                finished = kind
+    except queue.Empty:
+        pass
+
+    if finished == 'invalid':
+        CancelLoading()
+        ResetWidgets("Invalid file...")
+        txt_progress.set("")
+        return
+    if finished == 'unreadable':
+        CancelLoading()
+        ResetWidgets("")
+        txt_progress.set("")
+        messagebox.showinfo(message="{0}\n\n{1}\n\n{2}".format(
+            "Unable to open file at:",
+            filename,
+            "Check you have permission to access this directory.")
+            )
+        return
+
+    # Text results are shown as soon as the first simulations are parsed, the
+    # browser grows as more arrive. Binary results are already shown.
+    if finished == 'done' and sort_column is not None:
+        BuildSortIndex()
+    RefreshResults()
+    if selected_simulation is None and SimulationCount():
+        SelectSimulation(0)
+
+    if finished == 'cancelled':
+        status = "Cancelled, loaded"
+    elif finished:
+        status = "Loaded"
+    else:
+        status = "Loading..."
+    elapsed = time.perf_counter() - load_start
+    progress = "{0} {1} simulations ({2} MB/s)".format(
+        status,
+        len(maximums),
+        format(bytes_read / 1e6 / max(elapsed, 1e-9), '.2f'))
+    if finished:
+        btn_cancel['state'] = 'disabled'
+        if len(maximums) == 0 and binary_results is None:
+            ResetWidgets("Empty file...")
+        txt_progress.set(progress)
+    else:
+        # Only report progress once the queue has been drained.
+        if bytes_read:
+            txt_progress.set(progress)
+        root.after(POLL_INTERVAL, PollLoading, results_queue, filename)
+
+
+def ResetWidgets(message):
+    """Display message, reset widgets, clear lists and empty the browser."""
+    global binary_results, indexed_results, load_queue, view_offset
+    global selected_simulation, sort_column, sort_index, sort_positions
+    global bands, selected_path
+    # Stop and detach any file still loading.
+    CancelLoading()
+    load_queue = None
+    txt_message.set(message)
+    txt_maximum.set("")
+    txt_minimum.set("")
+    txt_average.set("")
+    maximums.clear()
+    minimums.clear()
+    averages.clear()
+    finals.clear()
+    successes.clear()
+    binary_results = None
+    indexed_results = None
+    view_offset = 0
+    selected_simulation = None
+    sort_column = None
+    sort_index = None
+    sort_positions = None
+    bands = None
+    selected_path = None
+    RefreshResults()
+    DrawFanChart()
+
+
+def SimulationCount():
+    """Return the number of simulations that can be browsed."""
+    # Every row of a binary file can be read straight away, text results can
+    # only be browsed once they are parsed.
+    if binary_results is not None:
+        return len(binary_results)
+    return len(maximums)
+
+
+def SimulationAt(position):
+    """Return the index of the simulation displayed at position of the browser."""
+    if sort_index is None or position >= len(sort_index):
+        return position
+    return int(sort_index[position])
+
+
+def SimulationValues(index):
+    """Return the maximum, minimum, average and final balance and success of
+    a simulation."""
+    if index < len(maximums):
+        return (maximums[index], minimums[index], averages[index],
+                finals[index], successes[index])
+    # Binary results not yet reached by the loading thread.
+    row = binary_results[index]
+    return (row.max(), row.min(), row.mean(), row[-1], bool(is_successful(row[-1])))
+
+
+def SimulationBalances(index):
+    """Return the balance of a simulation in each year, read from disk, or
+    None if the open file has no index and is not binary."""
+    if binary_results is not None:
+        return np.asarray(binary_results[index], dtype=np.float64)
+    if indexed_results is not None:
+        filename, header, records = indexed_results
+        return read_simulation(filename, header, records, index)
+    return None
+
+
+def BuildSortIndex():
+    """Sort the loaded simulations by sort_column, once, so the browser can
+    display any position of the sorted order without sorting again."""
+    global sort_index, sort_positions
+    sort_positions = None
+    if sort_column is None:
+        sort_index = None
+        return
+    values = np.asarray(SORT_COLUMNS[sort_column], dtype=np.float64)
+    sort_index = np.argsort(values, kind='stable')
+    if sort_descending:
+        sort_index = sort_index[::-1]
+
+
+def SortResults(column):
+    """Sort the browser by column, sorting by the same column again reverses
+    the order. Sorting by 'simulation' restores the file order."""
+    global sort_column, sort_descending, view_offset
+    if column == sort_column:
+        sort_descending = not sort_descending
+    else:
+        sort_descending = False
+    if column == 'simulation':
+        sort_column = None
+    else:
+        sort_column = column
+    BuildSortIndex()
+    view_offset = 0
+    RefreshResults()
+
+
+def RefreshResults():
+    """Materialize the VISIBLE_ROWS rows of the browser starting at view_offset."""
+    global view_offset
+    count = SimulationCount()
+    view_offset = max(0, min(view_offset, count - VISIBLE_ROWS))
+    tree_results.delete(*tree_results.get_children())
+    # Pad simulation numbers to the same width, at least three digits.
+    width = max(3, len(str(count)))
+    for position in range(view_offset, min(count, view_offset + VISIBLE_ROWS)):
+        index = SimulationAt(position)
+        maximum, minimum, average, final, successful = SimulationValues(index)
+        tree_results.insert('', 'end', iid=str(index), values=(
+            "Simulation #{0:0{1}d}".format(index + 1, width),
+            format(float(maximum), '.2f'),
+            format(float(minimum), '.2f'),
+            format(float(average), '.2f'),
+            format(float(final), '.2f'),
+            "successful" if successful else "unsuccessful"))
+    if selected_simulation is not None and tree_results.exists(str(selected_simulation)):
+        tree_results.selection_set(str(selected_simulation))
+    if count:
+        scr_results.set(view_offset / count, min(count, view_offset + VISIBLE_ROWS) / count)
+    else:
+        scr_results.set(0, 1)
+
+
+def ScrollResults(*args):
+    """Scrollbar command, moves the rows of the browser into view."""
+    global view_offset
+    if args[0] == 'moveto':
+        view_offset = int(float(args[1]) * SimulationCount())
+    elif args[0] == 'scroll':
+        if args[2] == 'pages':
+            view_offset += int(args[1]) * VISIBLE_ROWS
+        else:
+            view_offset += int(args[1])
+    RefreshResults()
+
+
+def WheelResults(event):
+    """Scroll the browser with the mouse wheel."""
+    if event.num == 4 or event.delta > 0:
+        ScrollResults('scroll', -3, 'units')
+    else:
+        ScrollResults('scroll', 3, 'units')
+    return 'break'
+
+
+def SelectSimulation(index):
+    """Select a simulation in the browser and display its balances."""
+    global selected_simulation
+    selected_simulation = index
+    if tree_results.exists(str(index)):
+        tree_results.selection_set(str(index))
+    ShowSimulation(index)
+
+
+def TreeviewSelectionChanged(event):
+    # Display the statistics of the simulation selected in the browser.
+    selection = tree_results.selection()
+    if selection and int(selection[0]) != selected_simulation:
+        SelectSimulation(int(selection[0]))
+
+
+def JumpToSimulation(event=None):
+    """Scroll the simulation number entered by the user to the top of the
+    browser, and select it."""
+    global view_offset, sort_positions
+    try:
+        index = int(txt_jump.get()) - 1
+    except ValueError:
+        index = -1
+    if not 0 <= index < SimulationCount():
+        txt_message.set("Invalid simulation number...")
+        return
+    txt_message.set("")
+    if sort_index is None or index >= len(sort_index):
+        view_offset = index
+    else:
+        if sort_positions is None:
+            sort_positions = np.empty_like(sort_index)
+            sort_positions[sort_index] = np.arange(len(sort_index))
+        view_offset = int(sort_positions[index])
+    RefreshResults()
+    SelectSimulation(index)
+
+
+def ShowSimulation(index):
+    """Display the maximum, minimum and average balance of a simulation."""
+    # Binary results are read from the memory mapped file, only this
+    # simulation's row is paged in.
+    if binary_results is not None:
+        row = binary_results[index]
+        maximum, minimum, average = row.max(), row.min(), row.mean()
+    else:
+        maximum, minimum, average = maximums[index], minimums[index], averages[index]
+    txt_maximum.set("Maximum balance: {0}".format(format(float(maximum), '.2f')))
+    txt_minimum.set("Minimum balance: {0}".format(format(float(minimum), '.2f')))
+    txt_average.set("Average balance: {0}".format(format(float(average), '.2f')))
+    SelectPath(index)
+
+
+def SelectPath(index):
+    """Keep the balance of a simulation in the years of the fan chart bands,
+    if they are known and its balances can be read, and redraw the chart."""
+    global selected_path
+    selected_path = None
+    if bands is not None and index is not None:
+        balances = SimulationBalances(index)
+        if balances is not None and len(balances) > bands[0][-1]:
+            selected_path = balances[bands[0]]
+    DrawFanChart()
+
+
+def DrawFanChart(event=None):
+    """Draw the percentile bands of every simulation, and the selected
+    simulation's balances, on the chart canvas.
+
+    Only the cached bands and selected_path are used, so redrawing, e.g. when
+    the window is resized, never reads the results again.
+    """
+    cnv_chart.delete('all')
+    width = cnv_chart.winfo_width()
+    height = cnv_chart.winfo_height()
+    # The canvas has no size until it is first drawn.
+    if width <= 1 or height <= 1:
+        width, height = CHART_WIDTH, CHART_HEIGHT
+    if bands is None:
+        cnv_chart.create_text(width / 2, height / 2, fill='grey',
+                text="Percentile bands of all simulations appear once a file is loaded")
+        return
+    years, values = bands
+    shown = [values[np.isfinite(values)]]
+    if selected_path is not None:
+        shown.append(selected_path[np.isfinite(selected_path)])
+    shown = np.concatenate(shown)
+    if shown.size == 0:
+        return
+    low, high = float(shown.min()), float(shown.max())
+    if high <= low:
+        high = low + 1
+    left, right = 2 * CHART_MARGIN, width - CHART_MARGIN / 2
+    top, bottom = CHART_MARGIN / 2, height - CHART_MARGIN
+    # Band years are stored columns, place and label them by the actual year.
+    if stored_years is not None and len(stored_years) > years[-1]:
+        years = stored_years[years]
+    x = left + (years - years[0]) / max(years[-1] - years[0], 1) * (right - left)
+
+    def Heights(balances):
+        # Canvas y coordinate of a balance in each band year.
+        balances = np.nan_to_num(balances, nan=low, posinf=high, neginf=low)
+        return bottom - (balances - low) / (high - low) * (bottom - top)
+
+    def Points(balances):
+        # Flat list of the canvas coordinates of a line through the balances.
+        return np.column_stack((x, Heights(balances))).ravel().tolist()
+
+    # Outer band P5 to P95, inner band P25 to P75, then the median. A band is
+    # drawn along its lower percentile and back along its upper one.
+    for lower, upper, colour in ((0, 4, '#c6dbef'), (1, 3, '#6baed6')):
+        outline = np.column_stack((np.concatenate((x, x[::-1])), np.concatenate(
+                (Heights(values[lower]), Heights(values[upper])[::-1]))))
+        cnv_chart.create_polygon(*outline.ravel().tolist(), fill=colour, outline='')
+    if low < 0 < high:
+        cnv_chart.create_line(*Points(np.zeros(len(years))), fill='grey', dash=(4, 2))
+    cnv_chart.create_line(*Points(values[2]), fill='#08519c', width=2)
+    if selected_path is not None:
+        cnv_chart.create_line(*Points(selected_path), fill='#e6550d')
+
+    cnv_chart.create_text(left - 5, top, anchor=E, text=format(high, ',.0f'))
+    cnv_chart.create_text(left - 5, bottom, anchor=E, text=format(low, ',.0f'))
+    cnv_chart.create_text(left, bottom + 5, anchor=N,
+            text="Year {0}".format(years[0] + 1))
+    cnv_chart.create_text(right, bottom + 5, anchor=NE,
+            text="Year {0}".format(years[-1] + 1))
+    cnv_chart.create_text((left + right) / 2, bottom + 5, anchor=N,
+            text="P5-P95 and P25-P75 bands, median and selected simulation")
+
+
+def OpenBinaryFile(filename):
+    """Open a binary result file written by fi.py.
+
+    The file is memory mapped, so it opens without reading the balances, the
+    statistics of every simulation are then computed in the background.
+    """
+    global binary_results
+    try:
+        header, balances, successful = read_binary(filename)
+    except ValueError:
+        ResetWidgets("Invalid file...")
+        return
+    if header['simulations'] == 0:
+        ResetWidgets("Empty file...")
+        return
+    ResetWidgets("")
+    binary_results = balances
+    RefreshResults()
+    SelectSimulation(0)
+    StartLoading(filename, True)
+
+
+def OpenIndexedFile(filename, header, records):
+    """Open a result file from the summary index fi.py wrote next to it.
+
+    Every statistic is read from the index, so the raw file is not scanned,
+    only a simulation's balances are read from it when they are needed.
+    """
+    global indexed_results
+    if header['simulations'] == 0:
+        ResetWidgets("Empty file...")
+        return
+    ResetWidgets("")
+    start = time.perf_counter()
+    maximums.extend(records['maximum'].tolist())
+    minimums.extend(records['minimum'].tolist())
+    averages.extend(records['mean'].tolist())
+    finals.extend(records['final'].tolist())
+    successes.extend(records['successful'].astype(bool).tolist())
+    indexed_results = (filename, header, records)
+    RefreshResults()
+    SelectSimulation(0)
+    txt_progress.set("Loaded {0} simulations from index in {1}s".format(
+        len(maximums), format(time.perf_counter() - start, '.2f')))
+    # Only the fan chart bands, if not saved yet, need a pass over the file.
+    StartLoading(filename, header['format'] == "binary", statistics=False)
+
+
 def OpenFileDialog():
     """Extract data from selected file.
 
     Raises:
         IOError: if unable to locate or open file.
         ValueError: if file cannot be processed, invalid file.
-        ZeroDivisionError: if invalid file is partly processed.
 
     """
     # 'filename' gets the directory of the file selected using filedialog
     filename = filedialog.askopenfilename(
-        filetypes = (("Text Documents", "*.txt"), ("All Files", "*.*"))
+        filetypes = (("Text Documents", "*.txt"), ("Binary Results", "*.fib"),
+                     ("All Files", "*.*"))
         )
     try:
+        # Use the summary index written by fi.py, if it matches the file.
+        index = read_index(filename) if filename else None
+        if index is not None:
+            OpenIndexedFile(filename, *index)
+            return
+        # Binary result files are recognised by their first bytes.
+        with open(filename, 'rb') as f:
+            is_binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+        if is_binary:
+            OpenBinaryFile(filename)
+            return
         # Open the selected file in 'readonly' mode.
         with open(filename, 'r') as f:
             # Check if file is empty, if true, notify the user, reset widgets,
             # clear lists, disable the combobox, and return.
             if os.stat(filename).st_size == 0:
-                txt_message.set("Empty file...")
-                txt_maximum.set("")
-                txt_minimum.set("")
-                txt_average.set("")   
-                cbo_results.set("")
-                cbo_results['state'] = 'disabled' 
-                maximums.clear()  
-                minimums.clear()  
-                averages.clear()  
+                ResetWidgets("Empty file...")
                 return
-            # Declare new list to hold values parsed from opened file.
-            values = []
-            # For each line in the file, split by spaces and append each value
-            # to a list inside 'values'.
-            for line in f:
-                values.append(line.split(' '))
-            # The string 'successful' or 'unsuccessful' is the last value of
-            # each line, pop() it from the end of each list in 'values'.
-            for i in range(len(values)):
-                values[i].pop()
-            # For each list in 'values' list.
-            for i in range(len(values)):
-                # Initial values for maximum, minimum and average variables.
-                maximum = 'start'
-                minimum = 'start'
-                average = 0
-                # Iterate over each element in each list in 'values',
-                # get maximum, minimum and average values of each simulation.
-                for value in values[i]:
-                    try:
-                        tmp_maximum = float(value)
-                        tmp_minimum = float(value)
-                        # If starting a new iteration, 'maximum' gets first
-                        # value of the list.
-                        if maximum == 'start':
-                            maximum = tmp_maximum
-                        # else, check if 'tmp_maximum' is > 'maximum', if true,
-                        # 'maximum' gets tmp_maximum.
-                        elif tmp_maximum > maximum:
-                            maximum = tmp_maximum
-                        # If starting a new iteration, 'minimum' gets first
-                        # value of the list.
-                        if minimum == 'start':
-                            minimum = tmp_minimum
-                        # else, check if 'tmp_minimum' is < 'minimum', if true,
-                        # 'minimum' gets tmp_minimum.                        
-                        elif tmp_minimum < minimum:
-                            minimum = tmp_minimum
-                        # 'average' gets the sum of all values in the list
-                        # being iterated. It is later divided by the number of
-                        # list elements to get the 'average' value.
-                        average += float(value)
-                    # An incorrectly formatted file will throw a ValueError.
-                    # Notify the user, reset widgets, clear lists, disable the
-                    # combobox, and return.
-                    except ValueError:
-                        txt_message.set("Invalid file...")
-                        txt_maximum.set("")
-                        txt_minimum.set("")
-                        txt_average.set("")  
-                        cbo_results.set("")
-                        cbo_results['state'] = 'disabled' 
-                        values.clear()
-                        maximums.clear()  
-                        minimums.clear()  
-                        averages.clear()  
-                        return                        
-                # Append parsed values to their corresponding lists before
-                # iterating over the next list in 'values'.
-                try:
-                    maximums.append(maximum)
-                    minimums.append(minimum)
-                    averages.append(average/(len(values[i])))
-                    txt_message.set("")
-                # An incorrectly formatted file will throw a ZeroDivisionError.
-                # Notify the user, reset widgets, clear lists, disable the
-                # combobox, and return.
-                except ZeroDivisionError:
-                    txt_message.set("Invalid file...")
-                    txt_maximum.set("")
-                    txt_minimum.set("")
-                    txt_average.set("")   
-                    cbo_results.set("")
-                    cbo_results['state'] = 'disabled' 
-                    values.clear() 
-                    maximums.clear()  
-                    minimums.clear()  
-                    averages.clear()  
-                    return
-            # Create a menu list for the combobox.
-            # For each list in 'values', append a string to 'combobox_menu',
-            # set the combobox configuration to use this list as its displayed
-            # value, set the combobox state to readonly and display the first
-            # element in 'combobox_menu', then, bind an event to be called
-            # whenever the user makes a selection in the combobox.
-            combobox_menu = []                 
-            for i in range(len(values)):
-                if (i+1) < 10:
-                    combobox_menu.append("Simulation #00" + str(i+1))
-                elif (i+1) >= 10 and i < 100:  
-                    combobox_menu.append("Simulation #0" + str(i+1))
-                else:
-                    combobox_menu.append("Simulation #" + str(i+1))                
-            cbo_results['values'] = combobox_menu
-            cbo_results['state'] = 'readonly' 
-            cbo_results.current(0)
-            cbo_results.bind('<<ComboboxSelected>>', ComboboxSelectionChanged)
-            # Display first element of 'maximums', 'minimums' and 'averages'.
-            txt_maximum.set("Maximum balance: {0}".format(
-                format(float(maximums[0]), '.2f')
-                ))
-            txt_minimum.set("Minimum balance: {0}".format(
-                format(float(minimums[0]), '.2f')
-                ))
-            txt_average.set("Average balance: {0}".format(
-                format(float(averages[0]), '.2f')
-                ))
+            # Clear any previously opened results, then parse the file a
+            # chunk at a time on a background thread, keeping only the
+            # statistics of each simulation.
+            ResetWidgets("")
+        StartLoading(filename, False)
     except IOError:
         # Prevent error when user closes filedialog without selecting a file.
         if filename == "":
@@ -177,80 +699,104 @@ def OpenFileDialog():
                 )
 
 
-def ComboboxSelectionChanged(event):
-    # Set labels text to display the value stored in the maximums, minimums and
-    # averages lists at the index corresponding combobox selection.
-    txt_maximum.set("Maximum balance: {0}".format(
-        format(maximums[cbo_results.current()], '.2f')
-        ))
-    txt_minimum.set("Minimum balance: {0}".format(
-        format(minimums[cbo_results.current()], '.2f')
-        ))
-    txt_average.set("Average balance: {0}".format(
-        format(averages[cbo_results.current()], '.2f')
-        ))
-
-
-
 # =========================================================================== #
 #                             Window and Widgets                              #
 # =========================================================================== #
 
-# Root window and title.
-root = Tk()
-root.title('Financial Independence GUI')
-
-# Tkinter Variables
-txt_maximum = StringVar()
-txt_minimum = StringVar()
-txt_average = StringVar()
-txt_message = StringVar()
-
-# Create 'content' frame to contain all widgets, child of 'root'.
-content = ttk.Frame(root,padding=(10,10,10,30),borderwidth=1,relief='raised')
-# Create various widgets, children of 'content' frame.
-btn_open = ttk.Button(content, text="Open...", command=OpenFileDialog)
-lbl_spacer1 = ttk.Label(content)
-lbl_select = ttk.Label(content, text="Select:")
-cbo_results = ttk.Combobox(content, state='readonly')
-lbl_spacer2 = ttk.Label(content)
-lbl_maximum = ttk.Label(content, textvariable=txt_maximum)
-lbl_minimum = ttk.Label(content, textvariable=txt_minimum)
-lbl_average = ttk.Label(content, textvariable=txt_average)
-lbl_message = ttk.Label(content, textvariable=txt_message)
-# Draw 'content' frame with grid and stick to N, S, E &  W of the 'root'.
-content.grid(sticky=(N,S,E,W))
-# Draw widgets to specified column/rows, apply padding and sticky attributes,
-# combobox widget get a default set() and state.
-btn_open.grid(column=1, row=1, sticky=(N,W))
-lbl_spacer1.grid(column=2, row=1, padx=125)
-lbl_select.grid(column=3, row=1, sticky=(N,E), pady=2, padx=6)
-cbo_results.grid(column=4, row=1, sticky=(N,E), pady=2)
-cbo_results.set("")
-cbo_results['state'] = 'disabled'
-lbl_spacer2.grid(column=1, row=2, columnspan=4, pady=3)
-lbl_maximum.grid(column=1, row=3, columnspan=4)
-lbl_minimum.grid(column=1, row=4, columnspan=4, pady=25)
-lbl_average.grid(column=1, row=5, columnspan=4)
-lbl_message.grid(column=1, row=2, sticky=N)
-# Configure column/row growth weights to give the application a responsive 
-# feel when window is being resized. 
-content.columnconfigure(1, weight=1)
-content.columnconfigure(2, weight=1)
-content.columnconfigure(3, weight=1920)
-content.columnconfigure(4, weight=1)
-content.rowconfigure(1, weight=1)
-content.rowconfigure(2, weight=100)
-content.rowconfigure(3, weight=20)
-content.rowconfigure(4, weight=20)
-content.rowconfigure(5, weight=20)
-content.rowconfigure(6, weight=400)
-root.columnconfigure(0, weight=1)
-root.rowconfigure(0, weight=1)
-# Get the windows width/height after widgets are drawn.
-root.update()
-# Set the windows minimum width/height to the windows size after widgets have
-# been initialized and drawn.
-root.minsize(root.winfo_width(), root.winfo_height())
-# Start tkinter mainloop.
-root.mainloop()
\ No newline at end of file
+# The window is only created when figui.py is run, so its parsing functions can
+# be imported without a display.
+if __name__ == "__main__":
+    # Root window and title.
+    root = Tk()
+    root.title('Financial Independence GUI')
+
+    # Tkinter Variables
+    txt_maximum = StringVar()
+    txt_minimum = StringVar()
+    txt_average = StringVar()
+    txt_message = StringVar()
+    txt_progress = StringVar()
+    txt_jump = StringVar()
+
+    # Create 'content' frame to contain all widgets, child of 'root'.
+    content = ttk.Frame(root,padding=(10,10,10,30),borderwidth=1,relief='raised')
+    # Create various widgets, children of 'content' frame.
+    btn_open = ttk.Button(content, text="Open...", command=OpenFileDialog)
+    lbl_spacer1 = ttk.Label(content)
+    lbl_select = ttk.Label(content, text="Go to simulation #:")
+    ent_jump = ttk.Entry(content, textvariable=txt_jump, width=10)
+    btn_jump = ttk.Button(content, text="Go", command=JumpToSimulation)
+    lbl_spacer2 = ttk.Label(content)
+    # The browser only ever holds VISIBLE_ROWS items, its scrollbar is driven by
+    # the number of simulations instead of by the Treeview.
+    tree_results = ttk.Treeview(content, height=VISIBLE_ROWS, show='headings',
+            selectmode='browse',
+            columns=('simulation', 'maximum', 'minimum', 'average', 'final', 'status'))
+    scr_results = ttk.Scrollbar(content, orient=VERTICAL, command=ScrollResults)
+    for column, heading in (('simulation', "Simulation"), ('maximum', "Maximum"),
+            ('minimum', "Minimum"), ('average', "Average"), ('final', "Final"),
+            ('status', "Status")):
+        tree_results.heading(column, text=heading)
+        tree_results.column(column, width=110, anchor=E)
+        # Clicking a heading sorts by it, except for the status column.
+        if column != 'status':
+            tree_results.heading(column,
+                    command=lambda column=column: SortResults(column))
+    lbl_maximum = ttk.Label(content, textvariable=txt_maximum)
+    lbl_minimum = ttk.Label(content, textvariable=txt_minimum)
+    lbl_average = ttk.Label(content, textvariable=txt_average)
+    cnv_chart = Canvas(content, width=CHART_WIDTH, height=CHART_HEIGHT,
+            background='white', highlightthickness=0)
+    lbl_message = ttk.Label(content, textvariable=txt_message)
+    btn_cancel = ttk.Button(content, text="Cancel", command=CancelLoading, state='disabled')
+    lbl_progress = ttk.Label(content, textvariable=txt_progress)
+    # Draw 'content' frame with grid and stick to N, S, E &  W of the 'root'.
+    content.grid(sticky=(N,S,E,W))
+    # Draw widgets to specified column/rows, apply padding and sticky attributes,
+    # and bind the browser's selection, mouse wheel and jump events.
+    btn_open.grid(column=1, row=1, sticky=(N,W))
+    lbl_spacer1.grid(column=2, row=1, padx=125)
+    lbl_select.grid(column=3, row=1, sticky=(N,E), pady=2, padx=6)
+    ent_jump.grid(column=4, row=1, sticky=(N,E), pady=2)
+    btn_jump.grid(column=5, row=1, sticky=(N,E), pady=2, padx=6)
+    lbl_spacer2.grid(column=1, row=2, columnspan=5, pady=3)
+    lbl_message.grid(column=1, row=2, sticky=N)
+    tree_results.grid(column=1, row=3, columnspan=5, sticky=(N,S,E,W))
+    scr_results.grid(column=6, row=3, sticky=(N,S))
+    lbl_maximum.grid(column=1, row=4, columnspan=5, pady=(25,0))
+    lbl_minimum.grid(column=1, row=5, columnspan=5, pady=25)
+    lbl_average.grid(column=1, row=6, columnspan=5)
+    cnv_chart.grid(column=1, row=7, columnspan=5, sticky=(N,S,E,W), pady=(25,0))
+    btn_cancel.grid(column=1, row=8, sticky=(S,W))
+    lbl_progress.grid(column=2, row=8, columnspan=4, sticky=(S,E))
+    tree_results.bind('<<TreeviewSelect>>', TreeviewSelectionChanged)
+    tree_results.bind('<MouseWheel>', WheelResults)
+    tree_results.bind('<Button-4>', WheelResults)
+    tree_results.bind('<Button-5>', WheelResults)
+    ent_jump.bind('<Return>', JumpToSimulation)
+    # The chart is redrawn from the cached bands whenever it is resized.
+    cnv_chart.bind('<Configure>', DrawFanChart)
+    # Configure column/row growth weights to give the application a responsive 
+    # feel when window is being resized. 
+    content.columnconfigure(1, weight=1)
+    content.columnconfigure(2, weight=1)
+    content.columnconfigure(3, weight=1920)
+    content.columnconfigure(4, weight=1)
+    content.columnconfigure(5, weight=1)
+    content.rowconfigure(1, weight=1)
+    content.rowconfigure(2, weight=100)
+    content.rowconfigure(3, weight=400)
+    content.rowconfigure(4, weight=20)
+    content.rowconfigure(5, weight=20)
+    content.rowconfigure(6, weight=20)
+    content.rowconfigure(7, weight=400)
+    content.rowconfigure(8, weight=100)
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(0, weight=1)
+    # Get the windows width/height after widgets are drawn.
+    root.update()
+    # Set the windows minimum width/height to the windows size after widgets have
+    # been initialized and drawn.
+    root.minsize(root.winfo_width(), root.winfo_height())
+    # Start tkinter mainloop.
+    root.mainloop()
\ No newline at end of file
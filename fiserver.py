@@ -0,0 +1,446 @@
+"""
+
+Financial Independence Simulation Service
+
+Serves the simulation engine of fi.py over HTTP on the local machine, so every
+planner submits jobs to one long running process instead of starting fi.py,
+answering its prompts and overwriting a shared output.txt. Jobs wait in a
+priority queue, a bounded number run at once on a single warm pool of worker
+processes, and each writes its own result file. Only the standard library and
+NumPy are needed.
+
+Version: 1.0
+
+"""
+
+
+
+import argparse
+import collections
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import fi
+
+
+# Address the service listens on, only the local machine by default.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Directory each job's result file is written to.
+JOBS_DIR = 'fijobs'
+# Jobs running at once, and most jobs waiting before new ones are refused.
+CONCURRENCY = 2
+MAX_QUEUE = 100
+# Most simulations a single job may request.
+MAX_SIMULATIONS = 1000000
+# Number of finished jobs whose latencies are kept for /metrics.
+LATENCY_WINDOW = 1000
+# Suffix of the result file of each output format.
+SUFFIXES = {'text': '.txt', 'binary': '.fib'}
+
+
+
+# =========================================================================== #
+#                                    Jobs                                     #
+# =========================================================================== #
+
+def parse_job(data):
+    """
+    Validate a job submitted as JSON.
+
+    Args:
+        data: dictionary with a 'parameters' dictionary holding each of
+            fi.PARAMETER_NAMES, and 'simulations'. Optional: 'seed', 'format'
+            ('summary', 'text' or 'binary', defaults to 'summary'), 'priority'
+            (lower runs first, defaults to 0), 'stop_on_ruin' and 'sampling'.
+    Returns:
+        A dictionary of the validated job.
+    Raises:
+        ValueError: if a value is missing or invalid.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('parameters'), dict):
+        raise ValueError("a job needs a 'parameters' object")
+    values = data['parameters']
+    parameters = []
+    for name in fi.PARAMETER_NAMES:
+        if name not in values:
+            raise ValueError("missing parameter '" + name + "'")
+        value = values[name]
+        if name in fi.INTEGER_PARAMETERS:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            # json.loads() accepts NaN and Infinity, no rate can be either.
+            valid = (isinstance(value, int) and not isinstance(value, bool) or
+                    isinstance(value, float) and math.isfinite(value))
+        if not valid:
+            raise ValueError("invalid value for '" + name + "'")
+        parameters.append(value)
+    if values['annual_spend'] < 0 or not 0 < values['num_years'] <= 9999:
+        raise ValueError("annual_spend must not be negative and num_years "
+                "must be between 1 and 9999")
+
+    simulations = data.get('simulations')
+    if (not isinstance(simulations, int) or isinstance(simulations, bool) or
+            not 0 < simulations <= MAX_SIMULATIONS):
+        raise ValueError("'simulations' must be between 1 and " +
+                str(MAX_SIMULATIONS))
+    seed = data.get('seed')
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    elif not isinstance(seed, int) or isinstance(seed, bool) or seed < 0:
+        raise ValueError("'seed' must be a non-negative integer")
+    output_format = data.get('format', 'summary')
+    if output_format not in ('summary', 'text', 'binary'):
+        raise ValueError("'format' must be 'summary', 'text' or 'binary'")
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("'priority' must be an integer")
+    sampling = data.get('sampling', 'random')
+    if sampling not in fi.SAMPLING_SCHEMES:
+        raise ValueError("'sampling' must be one of " + ", ".join(fi.SAMPLING_SCHEMES))
+    return {'parameters': tuple(parameters), 'simulations': simulations,
+            'seed': seed, 'format': output_format, 'priority': priority,
+            'options': {'stop_on_ruin': bool(data.get('stop_on_ruin')),
+                        'sampling': sampling}}
+
+
+def summary_report(summary):
+    """Return the figures print_summary() writes to the console as a
+    dictionary that can be sent as JSON."""
+    simulations = summary['simulations']
+    sketch = summary['final_balance']
+    average = summary['mean_total'] / simulations
+    return {'simulations': simulations, 'successful': summary['successful'],
+            'success_rate': summary['successful'] / simulations,
+            'standard_error': fi.success_standard_error(summary),
+            'sampling': summary.get('sampling', 'random'),
+            'final_balance': {'p5': sketch.quantile(0.05),
+                              'p50': sketch.quantile(0.50),
+                              'p95': sketch.quantile(0.95)},
+            # NaN is not valid JSON, overflowed runs are counted instead.
+            'average_balance': average if math.isfinite(average) else None,
+            'non_finite': summary.get('non_finite', 0),
+            'median_depletion_year': fi.median_depletion_year(summary)}
+
+
+def percentiles(values):
+    """Return the median, 95th percentile and maximum of a list of seconds,
+    or None if it is empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    return {'p50': values[len(values) // 2],
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': values[-1]}
+
+
+class SimulationService:
+    """
+    Queue of simulation jobs, run by a fixed number of threads on one shared
+    pool of worker processes.
+
+    Explanation:
+        Jobs are taken from a priority queue, lowest priority first and in
+        submission order within a priority. Each running job submits its
+        shards to the same ProcessPoolExecutor (see fi.map_shards()), so the
+        worker processes are started once and stay warm, and concurrent jobs
+        share the CPUs instead of each starting a pool of their own. jobs
+        holds the state of every job, guarded by lock.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, concurrency=CONCURRENCY, workers=None,
+                max_queue=MAX_QUEUE, cache=None):
+        self.jobs_dir = jobs_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cache = cache
+        os.makedirs(jobs_dir, exist_ok=True)
+        # Workers are spawned, not forked, as the service is multi-threaded.
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queued = 0
+        self.running = 0
+        self.started = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.simulations = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.threads = [threading.Thread(target=self._run_jobs, daemon=True)
+                for i in range(concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job):
+        """
+        Queue a job validated by parse_job().
+
+        Returns:
+            The job's state, see status().
+        Raises:
+            OverflowError: if max_queue jobs are already waiting.
+        """
+        with self.lock:
+            if self.queued >= self.max_queue:
+                raise OverflowError("the queue is full")
+            job_id = uuid.uuid4().hex
+            job = dict(job, id=job_id, status='queued', submitted=time.time(),
+                    started=None, finished=None, result=None, error=None,
+                    filename=None)
+            if job['format'] != "summary":
+                job['filename'] = os.path.join(self.jobs_dir,
+                        job_id + SUFFIXES[job['format']])
+            self.jobs[job_id] = job
+            self.queued += 1
+            self.queue.put((job['priority'], next(self.sequence), job_id))
+            return self._status(job)
+
+    def cancel(self, job_id):
+        """Cancel a queued job, returns its state, or None if there is no such
+        job. Running and finished jobs are not changed."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                job['status'] = 'cancelled'
+                job['finished'] = time.time()
+                self.queued -= 1
+            return self._status(job)
+
+    def status(self, job_id):
+        """Return the state of a job as a dictionary, or None if there is no
+        such job."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else self._status(job)
+
+    def _status(self, job):
+        state = {name: job[name] for name in ('id', 'status', 'seed', 'format',
+                'priority', 'simulations', 'submitted', 'started', 'finished',
+                'result', 'error')}
+        state['parameters'] = dict(zip(fi.PARAMETER_NAMES, job['parameters']))
+        if job['filename'] is not None:
+            state['result_file'] = os.path.abspath(job['filename'])
+        if job['status'] == 'queued':
+            # Jobs ahead of this one, for an estimate of the wait.
+            state['position'] = sum(1 for other in self.jobs.values()
+                    if other['status'] == 'queued' and
+                    (other['priority'], other['submitted']) <
+                    (job['priority'], job['submitted']))
+        return state
+
+    def metrics(self):
+        """Return the queue depth, latencies and throughput of the service."""
+        with self.lock:
+            uptime = time.time() - self.started
+            waits = [wait for wait, run, total in self.latencies]
+            runs = [run for wait, run, total in self.latencies]
+            totals = [total for wait, run, total in self.latencies]
+            return {'uptime': uptime, 'queue_depth': self.queued,
+                    'running': self.running, 'completed': self.completed,
+                    'failed': self.failed, 'workers': self.workers,
+                    'concurrency': len(self.threads),
+                    'jobs_per_second': self.completed / max(uptime, 1e-9),
+                    'simulations_per_second': self.simulations / max(uptime, 1e-9),
+                    'latency': {'queued': percentiles(waits),
+                                'running': percentiles(runs),
+                                'total': percentiles(totals)}}
+
+    def _run_jobs(self):
+        """Run queued jobs, one at a time, until the service is closed."""
+        while True:
+            priority, sequence, job_id = self.queue.get()
+            if job_id is None:
+                return
+            with self.lock:
+                job = self.jobs[job_id]
+                # Cancelled while it was waiting.
+                if job['status'] != 'queued':
+                    continue
+                job['status'] = 'running'
+                job['started'] = time.time()
+                self.queued -= 1
+                self.running += 1
+            try:
+                summary = fi.run_cached(self.cache, job['filename'], job['format'],
+                        job['parameters'], job['simulations'], job['seed'],
+                        self.workers, dict(job['options'], executor=self.executor))[0]
+                result, error = summary_report(summary), None
+            except Exception as exception:
+                result, error = None, str(exception) or type(exception).__name__
+            with self.lock:
+                job['finished'] = time.time()
+                job['result'] = result
+                job['error'] = error
+                job['status'] = 'failed' if error else 'done'
+                self.running -= 1
+                if error:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                    self.simulations += job['simulations']
+                self.latencies.append((job['started'] - job['submitted'],
+                        job['finished'] - job['started'],
+                        job['finished'] - job['submitted']))
+
+    def close(self):
+        """Stop the job threads once the running jobs finish, then the worker
+        processes. Queued jobs are not run."""
+        for thread in self.threads:
+            self.queue.put((float('-inf'), -1, None))
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown()
+
+
+
+# =========================================================================== #
+#                                 HTTP Server                                 #
+# =========================================================================== #
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    JSON interface of a SimulationService, at self.server.service.
+
+        POST /jobs               submit a job, see parse_job()
+        GET /jobs/<id>           state and summary of a job
+        GET /jobs/<id>/result    result file of a finished text or binary job
+        DELETE /jobs/<id>        cancel a queued job
+        GET /metrics             queue depth, latencies and throughput
+    """
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': "not found"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = parse_job(json.loads(self.rfile.read(length).decode('utf-8')))
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        try:
+            self.send_json(202, self.server.service.submit(job))
+        except OverflowError as error:
+            self.send_json(503, {'error': str(error)})
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip('/').split('/')
+        if parts == ['metrics']:
+            self.send_json(200, service.metrics())
+            return
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or (
+                len(parts) == 3 and parts[2] != 'result'):
+            self.send_json(404, {'error': "not found"})
+            return
+        state = service.status(parts[1])
+        if state is None:
+            self.send_json(404, {'error': "no such job"})
+        elif len(parts) == 2:
+            self.send_json(200, state)
+        elif state['status'] != 'done' or 'result_file' not in state:
+            self.send_json(409, {'error': "the job has no result file yet"})
+        else:
+            with open(state['result_file'], 'rb') as f:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length',
+                        str(os.fstat(f.fileno()).st_size))
+                self.end_headers()
+                shutil.copyfileobj(f, self.wfile)
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self.send_json(404, {'error': "not found"})
+            return
+        state = self.server.service.cancel(parts[1])
+        if state is None:
+            self.send_json(404, {'error': "no such job"})
+        else:
+            self.send_json(200, state)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False):
+    """Return an HTTP server for service, each request is handled on its own
+    thread. Call serve_forever() on it to start serving."""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    """Run the service until interrupted."""
+    parser = argparse.ArgumentParser(description="Serve fi.py simulations to "
+            "local clients over HTTP.")
+    parser.add_argument('--host', default=DEFAULT_HOST,
+        help="address to listen on, defaults to " + DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help="port to listen on, defaults to " + str(DEFAULT_PORT))
+    parser.add_argument('--jobs-dir', default=JOBS_DIR,
+        help="directory the result file of each job is written to, defaults "
+            "to " + JOBS_DIR)
+    parser.add_argument('--concurrency', type=fi.positive_integer, default=CONCURRENCY,
+        help="jobs run at once, defaults to " + str(CONCURRENCY))
+    parser.add_argument('--workers', type=fi.positive_integer,
+        help="worker processes shared by every job, defaults to the number of CPUs")
+    parser.add_argument('--max-queue', type=fi.positive_integer, default=MAX_QUEUE,
+        help="most jobs waiting before new ones are refused, defaults to " +
+            str(MAX_QUEUE))
+    parser.add_argument('--cache', metavar='DIR',
+        help="reuse the results of identical seeded jobs stored in DIR")
+    parser.add_argument('--verbose', action='store_true',
+        help="log every request")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache is not None:
+        cache = fi.ResultCache(args.cache)
+    service = SimulationService(args.jobs_dir, args.concurrency, args.workers,
+            args.max_queue, cache)
+    server = serve(service, args.host, args.port, args.verbose)
+    print("Serving simulations on http://" + args.host + ":" +
+        str(server.server_address[1]) + "/jobs")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+
+# Entry point for the service.
+if __name__ == "__main__":
+    main()